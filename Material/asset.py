@@ -1,20 +1,16 @@
 import os
 import hydra
 import logging
-from tqdm import tqdm
 import numpy as np
-from asset_visualiser import render_views
-from asset_segmentation import sam_image
+from asset_visualiser import render_assets
+from asset_segmentation import sam_image, sam_image_cpu
 from asset_vlm import query_vlm
-from omegaconf import DictConfig, OmegaConf
+from omegaconf import DictConfig
 from sam2.build_sam import build_sam2
-from utils.sam_utils import create, seed_everything, save_gpt_input
+from utils.sam_utils import seed_everything, save_gpt_input
 
 from hydra.core.global_hydra import GlobalHydra
 GlobalHydra.instance().clear()
-os.environ["DISPLAY"] = ":1"
-import pyglet
-pyglet.options['headless'] = True
 
 class AssetsMaterialPipeline:
     def __init__(
@@ -33,30 +29,60 @@ class AssetsMaterialPipeline:
         asset_path_list = os.listdir(GLB_folder_path)
         assert np.all([asset_path.endswith('.glb') for asset_path in asset_path_list]), "All assets must be in GLB format"
         
-        for asset_name in asset_path_list:
-            if os.path.splitext(asset_name)[0].endswith("_rotated"):
-                asset_path_list.remove(asset_name) 
+        # Skip rotated copies exported by earlier runs (RENDER.save_rotated)
+        asset_path_list = [
+            asset_name for asset_name in asset_path_list
+            if not os.path.splitext(asset_name)[0].endswith("_rotated")
+        ]
 
         azimuth_angles = self.config.RENDER.azimuth_angles
         elevation_angles = self.config.RENDER.elevation_angles
+        view_selection = self.config.RENDER.view_selection
+        coverage_target = self.config.RENDER.coverage_target
+        max_views = self.config.RENDER.max_views
+        num_candidates = self.config.RENDER.num_candidates
         trillis_asset = self.config.RENDER.trillis_asset
         replace_org_file = self.config.RENDER.replace_org_file
+        save_rotated = self.config.RENDER.save_rotated
         fov_deg = self.config.RENDER.fov_deg
         resolution = self.config.RENDER.resolution
         mark = self.config.RENDER.mark
-
-        for _, asset_path in tqdm(enumerate(asset_path_list), desc="Rendering Asset Images"):
-            render_views(
-                glb_path=os.path.join(GLB_folder_path, asset_path),
-                out_dir=self.render_asset,
-                azimuth_angles=azimuth_angles,
-                elevation_angles=elevation_angles,
-                trillis_asset=trillis_asset,
-                replace_org_file=replace_org_file,
-                fov_deg=fov_deg,
-                resolution=resolution,
-                mark=mark,
-            )
+        # Geometry segmentation and the view fusion read the buffers written by the render pass
+        buffers = self.config.RENDER.buffers or self.config.SEGMENTATION.mode == 'geometry' or self.config.SEGMENTATION.fuse_views
+        backend = self.config.RENDER.backend
+
+        num_workers = self.config.RENDER.num_workers
+        cache_dir = self.config.RENDER.cache_dir
+        mesh_cache_dir = self.config.MESH.cache_dir
+        face_budget = self.config.MESH.render_faces
+
+        # Each worker (or this process) keeps one renderer for all of its assets
+        failures = render_assets(
+            glb_paths=[os.path.join(GLB_folder_path, asset_path) for asset_path in asset_path_list],
+            num_workers=num_workers,
+            backend=backend,
+            out_dir=self.render_asset,
+            azimuth_angles=azimuth_angles,
+            elevation_angles=elevation_angles,
+            view_selection=view_selection,
+            coverage_target=coverage_target,
+            max_views=max_views,
+            num_candidates=num_candidates,
+            trillis_asset=trillis_asset,
+            replace_org_file=replace_org_file,
+            save_rotated=save_rotated,
+            fov_deg=fov_deg,
+            resolution=resolution,
+            mark=mark,
+            buffers=buffers,
+            cache_dir=cache_dir,
+            mesh_cache_dir=mesh_cache_dir,
+            face_budget=face_budget,
+        )
+        if len(failures) > 0:
+            print(f"{len(failures)} of {len(asset_path_list)} assets failed to render:")
+            for glb_path, error in failures.items():
+                print(f"  {glb_path}: {error}")
 
     def asset_segmentation(self) -> None:
 
@@ -74,18 +100,21 @@ class AssetsMaterialPipeline:
         crop_n_points_downscale_factor = self.config.SEGMENTATION.crop_n_points_downscale_factor
         min_mask_region_area = self.config.SEGMENTATION.min_mask_region_area
         use_m2m = self.config.SEGMENTATION.use_m2m
+        mode = self.config.SEGMENTATION.mode
+        encoder_batch_size = self.config.SEGMENTATION.encoder_batch_size
+        embedding_cache_dir = self.config.SEGMENTATION.embedding_cache_dir
+        embedding_cache_gb = self.config.SEGMENTATION.embedding_cache_gb
+        cpu_precision = self.config.SEGMENTATION.cpu_precision
+        num_threads = self.config.SEGMENTATION.num_threads
+        num_workers = self.config.SEGMENTATION.num_workers
+        fuse_views = self.config.SEGMENTATION.fuse_views
+        views_per_part = self.config.SEGMENTATION.views_per_part
+        max_pending_writes = self.config.SEGMENTATION.max_pending_writes
+        crop_margin = self.config.SEGMENTATION.crop_margin
+        min_foreground_area = self.config.SEGMENTATION.min_foreground_area
 
         logging.getLogger().setLevel(logging.ERROR)
-        sam2 = build_sam2(
-            model_cfg,
-            sam2_checkpoint,
-            device=device,
-            apply_postprocessing=False
-        )
-
-        sam_image(
-            sam2=sam2,
-            render_images_path=self.render_asset,
+        sam_kwargs = dict(
             points_per_side=points_per_side,
             points_per_batch=points_per_batch,
             pred_iou_thresh=pred_iou_thresh,
@@ -96,7 +125,35 @@ class AssetsMaterialPipeline:
             crop_n_points_downscale_factor=crop_n_points_downscale_factor,
             min_mask_region_area=min_mask_region_area,
             use_m2m=use_m2m,
+            mode=mode,
+            encoder_batch_size=encoder_batch_size,
+            embedding_cache_dir=embedding_cache_dir,
+            embedding_cache_gb=embedding_cache_gb,
+            sam2_checkpoint=sam2_checkpoint,
+            model_cfg=model_cfg,
+            fuse_views=fuse_views,
+            views_per_part=views_per_part,
+            max_pending_writes=max_pending_writes,
+            crop_margin=crop_margin,
+            min_foreground_area=min_foreground_area,
         )
+        if device == 'cpu':
+            # Reduced precision encoder, pinned threads and one worker per socket
+            sam_image_cpu(
+                render_images_path=self.render_asset,
+                build_kwargs=dict(model_cfg=model_cfg, sam2_checkpoint=sam2_checkpoint, cpu_precision=cpu_precision),
+                num_workers=num_workers,
+                num_threads=num_threads,
+                **sam_kwargs,
+            )
+        else:
+            sam2 = build_sam2(
+                model_cfg,
+                sam2_checkpoint,
+                device=device,
+                apply_postprocessing=False
+            )
+            sam_image(sam2=sam2, render_images_path=self.render_asset, **sam_kwargs)
 
         save_gpt_input(self.render_asset)
 
@@ -0,0 +1,24 @@
+import argparse
+from utils.asset_processor import process_assets
+
+
+if __name__ == "__main__":
+    # Example: split every OBJ of a folder into submeshes (run from Material/)
+    # python asset_batch.py extract "assets/*.obj" --num_workers 8
+    args = argparse.ArgumentParser()
+    args.add_argument("command", type=str, choices=["extract", "merge", "rotate"])
+    args.add_argument("inputs", type=str, nargs="+", help="files, directories or glob patterns")
+    args.add_argument("--output_dir", type=str, default="assets/processed")
+    args.add_argument("--num_workers", type=int, default=None)
+    args.add_argument("--cache_dir", type=str, default=None)
+    args = args.parse_args()
+
+    failures = process_assets(
+        command=args.command,
+        inputs=args.inputs,
+        output_dir=args.output_dir,
+        num_workers=args.num_workers,
+        cache_dir=args.cache_dir,
+    )
+    if len(failures) > 0:
+        raise SystemExit(1)
@@ -1,19 +1,104 @@
 import os
+import collections
+import multiprocessing
 import numpy as np
 import torch
-import cv2
 import argparse
 from PIL import Image
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 from sam2.build_sam import build_sam2
 from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
-from utils.sam_utils import create, seed_everything, save_gpt_input
+from sam2.utils.amg import generate_crop_boxes
+from utils.fusion_utils import fuse_parts
+from utils.sam_utils import AsyncWriter, EmbeddingCache, write, create, prefetch_assets, create_from_instances, submesh_count, seed_everything, save_gpt_input, cpu_sockets, configure_cpu, optimize_for_cpu
 
 import warnings
 # Ignore the SAM2 UserWarning if it appears
 warnings.filterwarnings("ignore", category=UserWarning)
 
+
+class BatchedMaskGenerator(SAM2AutomaticMaskGenerator):
+    """
+    SAM2AutomaticMaskGenerator whose image encoder can run over many images at once.
+
+    `encode_batch` embeds every crop of the given images in batches and queues
+    the features; the following `generate` calls (same images, same order)
+    then decode their point prompts against the queued features instead of
+    encoding each crop on its own. Without queued features `generate` behaves
+    exactly like the parent class. With an `embedding_cache`, crops encoded
+    in an earlier run are loaded from it instead of encoded again, and new
+    ones are saved to it through `writer` (an `AsyncWriter`) if set.
+    """
+
+    def __init__(self, *args, embedding_cache: EmbeddingCache = None, writer: AsyncWriter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.embedding_cache = embedding_cache
+        self.writer = writer
+        self._queued = collections.deque()
+        self._encode_image = self.predictor.set_image
+        self.predictor.set_image = self._set_queued_image
+
+    @torch.no_grad()
+    def encode_batch(self, images: list, batch_size: int = 8) -> None:
+        """Queue the embeddings of all crops of `images` (HWC RGB uint8), `batch_size` crops per forward."""
+        # Embeddings left over from an interrupted batch belong to other images
+        self._queued.clear()
+        crops = []
+        for image in images:
+            crop_boxes, _ = generate_crop_boxes(image.shape[:2], self.crop_n_layers, self.crop_overlap_ratio)
+            crops += [image[y0:y1, x0:x1, :] for x0, y0, x1, y1 in crop_boxes]
+
+        queued = [None] * len(crops)
+        if self.embedding_cache is not None:
+            keys = [self.embedding_cache.key(crop) for crop in crops]
+            queued = [self.embedding_cache.load(key, self.predictor.device) for key in keys]
+
+        # Only the crops missing from the cache go through the encoder
+        misses = [i for i, features in enumerate(queued) if features is None]
+        for start in range(0, len(misses), batch_size):
+            batch = misses[start:start + batch_size]
+            self.predictor.set_image_batch([crops[i] for i in batch])
+            features = self.predictor._features
+            for j, i in enumerate(batch):
+                queued[i] = {
+                    "image_embed": features["image_embed"][j:j + 1],
+                    "high_res_feats": [feat[j:j + 1] for feat in features["high_res_feats"]],
+                }
+                if self.embedding_cache is not None:
+                    # Decode the fp16-rounded features a later cache hit loads, so warm and cold runs give the same masks
+                    queued[i] = {
+                        "image_embed": queued[i]["image_embed"].half().float(),
+                        "high_res_feats": [feat.half().float() for feat in queued[i]["high_res_feats"]],
+                    }
+                    self.embedding_cache.store(keys[i], queued[i], self.writer)
+        self.predictor.reset_predictor()
+
+        self._queued.extend((crop.shape[:2], features) for crop, features in zip(crops, queued))
+        if self.embedding_cache is not None and len(misses) > 0:
+            # After the stores queued above
+            write(self.writer, self.embedding_cache.evict)
+
+    def _set_queued_image(self, image: np.ndarray) -> None:
+        """Stand-in for `predictor.set_image` that installs the next queued embedding."""
+        if len(self._queued) == 0:
+            return self._encode_image(image)
+        orig_hw, features = self._queued.popleft()
+        assert orig_hw == image.shape[:2], f"queued crop of size {orig_hw} used for an image of size {image.shape[:2]}"
+        self.predictor.reset_predictor()
+        self.predictor._orig_hw = [orig_hw]
+        self.predictor._features = features
+        self.predictor._is_image_set = True
+
+
+def build_segmentation_model(model_cfg: str, sam2_checkpoint: str, device: str = 'cuda', cpu_precision: str = 'fp32') -> torch.nn.Module:
+    """Build SAM2 on `device`; on the CPU the image encoder runs in `cpu_precision` (see `optimize_for_cpu`)."""
+    sam2 = build_sam2(model_cfg, sam2_checkpoint, device=device, apply_postprocessing=False)
+    if device == 'cpu':
+        sam2 = optimize_for_cpu(sam2, cpu_precision)
+    return sam2
+
+
 def sam_image(
         sam2: torch.nn.Module,
         render_images_path: str,
@@ -27,9 +112,44 @@ def sam_image(
         crop_n_points_downscale_factor: int = 1,
         min_mask_region_area: int = 900,
         use_m2m: bool = False,
+        mode: str = 'sam',
+        encoder_batch_size: int = 8,
+        embedding_cache_dir: str = None,
+        embedding_cache_gb: float = 20,
+        sam2_checkpoint: str = None,
+        model_cfg: str = None,
+        cpu_precision: str = 'fp32',
+        assets: list = None,
+        fuse_views: bool = False,
+        views_per_part: int = 1,
+        max_pending_writes: int = 64,
+        crop_margin: int = None,
+        min_foreground_area: int = 0,
     ):
-    
-    mask_generator = SAM2AutomaticMaskGenerator(
+    """
+    Segment the rendered views of every asset in `render_images_path`.
+
+    The SAM2 embeddings of the views can be cached in `embedding_cache_dir`
+    (keyed by image, `sam2_checkpoint` and `model_cfg`, at most
+    `embedding_cache_gb` GB), so sweeps over the mask generator thresholds
+    on unchanged renders only run the mask decoder. None (the default)
+    disables the cache: at about 9 MB per crop a library run only fills it.
+    `assets` restricts the run to these asset folders (all if None).
+    With `fuse_views` the parts of all views are linked into global parts
+    through the depth buffers (see `fuse_parts`), and only `views_per_part`
+    views per global part are kept as VLM inputs.
+    The outputs are written by a background `AsyncWriter` holding at most
+    `max_pending_writes` files (0 writes them synchronously).
+    With `crop_margin` the views are segmented within their foreground box
+    (see `create`), views under `min_foreground_area` pixels are skipped.
+    """
+    embedding_cache = None
+    if embedding_cache_dir is not None:
+        precision = cpu_precision if sam2.device.type == 'cpu' else 'fp32'
+        embedding_cache = EmbeddingCache(embedding_cache_dir, sam2_checkpoint, model_cfg, max_bytes=int(embedding_cache_gb * 2 ** 30), precision=precision)
+
+    writer = AsyncWriter(max_pending_writes) if max_pending_writes > 0 else None
+    mask_generator = BatchedMaskGenerator(
         model=sam2,
         points_per_side=points_per_side,
         points_per_batch=points_per_batch,
@@ -41,53 +161,114 @@ def sam_image(
         crop_n_points_downscale_factor=crop_n_points_downscale_factor,
         min_mask_region_area=min_mask_region_area,
         use_m2m=use_m2m,
+        embedding_cache=embedding_cache,
+        writer=writer,
     )
 
-    for idx, asset in tqdm(enumerate(os.listdir(render_images_path)), desc="Segmenting assets", unit=" asset"):
-        asset_path = os.path.join(render_images_path, asset)
-        img_folder = os.path.join(asset_path, 'images')
-        data_list = sorted(os.listdir(img_folder))
-        img_list = []
-        alpha_list = []
+    assets = os.listdir(render_images_path) if assets is None else assets
+    try:
+        # Every view is decoded once, the next asset's views on a background thread while this one is segmented
+        for asset, data_list, imgs, alphas in tqdm(prefetch_assets(render_images_path, assets), total=len(assets), desc="Segmenting assets", unit=" asset"):
+            asset_path = os.path.join(render_images_path, asset)
 
-        for data_path in data_list:
-            image_path = os.path.join(img_folder, data_path)
-            image_rgba = cv2.imread(image_path, cv2.IMREAD_UNCHANGED).astype(np.uint8)
-            alpha = image_rgba[:, :, 3]
+            save_folder = os.path.join(asset_path, 'seg')
+            os.makedirs(save_folder, exist_ok=True)
 
-            # Ensure alpha mask is binary
-            alpha[alpha < 125] = 0
-            alpha[alpha >= 125] = 255
+            # Generate segmentation maps, from the submesh instance buffers when the asset has several submeshes
+            if mode == 'geometry' and submesh_count(asset_path, data_list) > 1:
+                seg_map_vis = create_from_instances(imgs, data_list, save_folder, asset_path, writer=writer)
+            else:
+                seg_map_vis = create(
+                    imgs, alphas, data_list, save_folder, mask_generator, batch_size=encoder_batch_size,
+                    writer=writer, crop_margin=crop_margin, min_foreground_area=min_foreground_area,
+                )
 
-            image = cv2.imread(image_path)
-            image = torch.from_numpy(image)
+            parts_file = os.path.join(asset_path, 'parts.json')
+            if os.path.exists(parts_file):
+                os.remove(parts_file)
+            if fuse_views and writer is not None:
+                # The fusion reads the label maps back
+                writer.flush()
+            if fuse_views and fuse_parts(asset_path, data_list, views_per_part=views_per_part) is None:
+                print(f"{asset}: no depth buffers, the views are not fused")
+    finally:
+        # Stop the writer thread also when an asset fails, keeping the writes submitted so far
+        if writer is not None:
+            writer.close()
 
-            img_list.append(image)
-            alpha_list.append(alpha[None, ...])
+    if writer is not None:
+        writer.report()
+    sam2.to('cpu')
+    del sam2
 
-        # Prepare images and alphas for processing
-        images = [img_list[i].permute(2, 0, 1)[None, ...] for i in range(len(img_list))]
-        imgs = torch.cat(images)
-        alphas = np.concatenate(alpha_list, 0)
 
-        save_folder = os.path.join(asset_path, 'seg')
-        os.makedirs(save_folder, exist_ok=True)
+def _sam_worker(cpus: list, num_threads: int, build_kwargs: dict, sam_kwargs: dict) -> None:
+    """Segment a shard of the assets in a process pinned to `cpus`."""
+    configure_cpu(cpus, num_threads)
+    seed_everything(42)
+    sam_image(build_segmentation_model(**build_kwargs), **sam_kwargs)
 
-        # Generate segmentation maps
-        seg_map_vis = create(imgs, alphas, data_list, save_folder, mask_generator)
-    
-    sam2.to('cpu')
-    del sam2
+
+def sam_image_cpu(
+        render_images_path: str,
+        build_kwargs: dict,
+        num_workers: int = 1,
+        num_threads: int = None,
+        **sam_kwargs,
+    ):
+    """
+    CPU segmentation of all assets in `render_images_path` with one model per worker.
+
+    Workers are spread over the CPU sockets, each pinned to its share of the
+    cores of one socket (so its threads and memory stay on that socket), and
+    every worker segments an interleaved shard of the assets. With
+    `num_workers <= 1` the assets are segmented in this process.
+
+    Parameters:
+        render_images_path: Folder of the rendered assets.
+        build_kwargs: `build_segmentation_model` arguments (model_cfg, sam2_checkpoint, cpu_precision).
+        num_workers: Number of worker processes, e.g. one per socket.
+        num_threads: Intra-op threads per worker, one per pinned core if None.
+        sam_kwargs: Passed to `sam_image` (thresholds, caches...).
+    """
+    build_kwargs = dict(build_kwargs, device='cpu')
+    sam_kwargs = dict(sam_kwargs, render_images_path=render_images_path, cpu_precision=build_kwargs.get('cpu_precision', 'fp32'))
+    if num_workers <= 1:
+        configure_cpu(num_threads=num_threads)
+        sam_image(build_segmentation_model(**build_kwargs), **sam_kwargs)
+        return
+
+    sockets = cpu_sockets()
+    assets = sorted(os.listdir(render_images_path))
+    workers = []
+    # 'spawn' so that every worker starts its own thread pool after pinning
+    context = multiprocessing.get_context('spawn')
+    for worker in range(num_workers):
+        socket = sockets[worker % len(sockets)]
+        # Workers sharing a socket split its cores
+        sharing = len(range(worker % len(sockets), num_workers, len(sockets)))
+        cpus = np.array_split(socket, sharing)[worker // len(sockets)].tolist() or socket
+        process = context.Process(
+            target=_sam_worker,
+            args=(cpus, num_threads, build_kwargs, dict(sam_kwargs, assets=assets[worker::num_workers])),
+        )
+        process.start()
+        workers.append(process)
+    for process in workers:
+        process.join()
+    failed = [worker for worker, process in enumerate(workers) if process.exitcode != 0]
+    if len(failed) > 0:
+        raise RuntimeError(f"Segmentation workers {failed} failed")
 
 
 if __name__ == '__main__':
-    device = "cuda"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
     sam2_checkpoint = "./sam2/checkpoints/sam2_hiera_base_plus.pt"
     model_cfg = "configs/sam2/sam2_hiera_b+.yaml"
     assets_path = "renders"
 
     seed_everything(42)
 
-    sam2 = build_sam2(model_cfg, sam2_checkpoint, device=device, apply_postprocessing=False)
+    sam2 = build_segmentation_model(model_cfg, sam2_checkpoint, device=device)
     sam_image(sam2, assets_path)
     save_gpt_input(assets_path)
\ No newline at end of file
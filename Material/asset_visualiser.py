@@ -1,13 +1,30 @@
 import os
+import shutil
 import argparse
-import trimesh
+import multiprocessing
 import numpy as np
-from pyglet import gl
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
 from tqdm import tqdm
-from trimesh.transformations import transform_points
-from utils.asset_processor import glb_asset_rotator
-from matplotlib import pyplot as plt
-os.environ['DISPLAY'] = ':1'
+from utils.asset_processor import scene_rotator, decimate_scene, load_lod
+from utils.mesh_utils import load_scene
+from utils.render_utils import Renderer, RenderCache, create_renderer, camera_poses, project_points, draw_marks, fibonacci_views, select_views, save_cameras, save_buffers, load_cameras
+
+# Axes from the world origin (length 0.5, x/y/z in red/green/blue) and the mark point
+MARK_POINTS = np.array([[0, 0, 0], [0.5, 0, 0], [0, 0.5, 0], [0, 0, 0.5], [0.5, 0.5, 0.5]])
+MARK_AXES = np.array([[0, 1], [0, 2], [0, 3]])
+MARK_AXIS_COLORS = np.array([[255, 0, 0, 255], [0, 255, 0, 255], [0, 0, 255, 255]], dtype=np.uint8)
+MARK_POINT_COLORS = np.array([[255, 0, 0, 255]], dtype=np.uint8)
+
+
+def export_rotated(scene, glb_path: str, replace_org_file: bool = False) -> None:
+    """Export the rotated `scene` over `glb_path` if `replace_org_file`, else as `<name>_rotated.glb` next to it."""
+    if replace_org_file:
+        scene.export(glb_path)
+    else:
+        scene.export(os.path.splitext(glb_path)[0] + '_rotated.glb')
 
 
 def render_views(
@@ -17,9 +34,20 @@ def render_views(
         elevation_angles: list = [0, 60, -60],
         trillis_asset: bool = True,
         replace_org_file: bool = False,
+        save_rotated: bool = False,
         fov_deg: float = 60,
         resolution: tuple = (800, 600),
         mark: bool = False,
+        buffers: bool = False,
+        backend: str = 'gl',
+        renderer: Renderer = None,
+        cache_dir: str = None,
+        view_selection: str = 'grid',
+        coverage_target: float = 0.95,
+        max_views: int = 9,
+        num_candidates: int = 64,
+        mesh_cache_dir: str = None,
+        face_budget: int = None,
         ):
     """
     Render images from various azimuth and elevation angles.
@@ -31,116 +59,290 @@ def render_views(
         elevation_angles: List of elevation angles (in degrees).
         trillis_asset: Whether the asset is a Trillis asset.
         replace_org_file: Whether to replace the original file with the rotated one.
+        save_rotated: Whether to also export the rotated asset as `<name>_rotated.glb`.
         fov_deg: Field of view angle (in degrees).
         resolution: Image resolution (width, height).
-        mark: Whether to mark a point and axes in the image.
+        mark: Whether to draw the world axes and a mark point into the rendered images.
+        buffers: Whether to also write depth, normal and per-submesh instance
+            buffers of every view to `buffers/render_i.npz` (same draw, see `save_buffers`).
+        backend: Render backend used when no renderer is given, 'gl' or 'software'.
+        renderer: Reusable renderer; a temporary one is created (and closed) if None.
+        cache_dir: Render cache folder; unchanged assets are restored from it instead of rendered.
+        view_selection: 'grid' renders every azimuth/elevation pair, 'adaptive' renders the
+            fewest of the grid pairs plus `num_candidates` sphere directions that cover
+            `coverage_target` of the visible surface (see `select_views`).
+        coverage_target: Fraction of the visible surface area the adaptive views must see.
+        max_views: Maximum number of adaptive views.
+        num_candidates: Number of sphere directions added to the adaptive candidates.
+        mesh_cache_dir: Mesh cache folder; the GLB is decoded once and then loaded from it (see `load_scene`).
+        face_budget: Render a LOD with at most about this many faces (see `lod_file`), None renders the full mesh.
     
     Returns:
         Transforms: List of camera transforms.
         Ks: List of intrinsic matrices.
     """
-    out_dir = out_dir + '/' + os.path.basename(glb_path).split('.')[0] + '/' + "images"
+    asset_path = out_dir + '/' + os.path.basename(glb_path).split('.')[0]
+    out_dir = asset_path + '/' + "images"
+    # Views of an earlier render (another view set or angles) and the per-view
+    # segmentation / VLM inputs derived from them must not outlive it
+    for folder in ('images', 'buffers', 'seg', 'vis_seg', 'gpt_input'):
+        shutil.rmtree(os.path.join(asset_path, folder), ignore_errors=True)
+    for name in ('cameras.npz', 'parts.json'):
+        if os.path.exists(os.path.join(asset_path, name)):
+            os.remove(os.path.join(asset_path, name))
     os.makedirs(out_dir, exist_ok=True)
+    if buffers:
+        os.makedirs(os.path.join(asset_path, 'buffers'), exist_ok=True)
 
     if not os.path.exists(glb_path):
         raise FileNotFoundError(f"GLB asset not found at {glb_path}")
 
+    if cache_dir is not None:
+        cache = RenderCache(cache_dir)
+        cache_key = cache.key(glb_path, dict(
+            azimuth_angles=azimuth_angles,
+            elevation_angles=elevation_angles,
+            trillis_asset=trillis_asset,
+            fov_deg=fov_deg,
+            resolution=resolution,
+            mark=mark,
+            buffers=buffers,
+            backend=backend if renderer is None else renderer.backend,
+            view_selection=view_selection,
+            face_budget=face_budget,
+            **(dict(
+                coverage_target=coverage_target,
+                max_views=max_views,
+                num_candidates=num_candidates,
+            ) if view_selection == 'adaptive' else {}),
+        ))
+        if cache.restore(cache_key, asset_path):
+            if trillis_asset and (replace_org_file or save_rotated):
+                # The renders are cached, the requested export is not
+                export_rotated(scene_rotator(load_scene(glb_path, cache_dir=mesh_cache_dir)), glb_path, replace_org_file)
+            cameras = load_cameras(asset_path)
+            return list(cameras['transforms']), list(cameras['Ks'])
+
+    # Load the GLB asset, or its cached LOD unless the full asset is exported again
+    if face_budget is not None and not (trillis_asset and (replace_org_file or save_rotated)):
+        scene = load_lod(glb_path, face_budget, cache_dir=mesh_cache_dir)
+    else:
+        scene = load_scene(glb_path, cache_dir=mesh_cache_dir)
+
     if trillis_asset:
 
         # if the asset is a Trillis asset, rotate it to the correct orientation
+        # The rotation is applied in memory, writing it out is optional:
+        # save_rotated=True exports `<name>_rotated.glb` next to the asset
         # If you what to replace the original file with the rotated one, set replace_org_file=True
         # NOTE: This will overwrite the original file
 
         # print("Rotating asset to correct orientation...")
-        if os.path.exists(glb_path.replace('.glb', '_rotated.glb')):
-            glb_path = glb_path.replace('.glb', '_rotated.glb')
-        else:
-            glb_path = glb_asset_rotator(glb_path, replace_org_file=replace_org_file)
-    
-    # Load the GLB asset
-    scene = trimesh.load(glb_path)
+        scene = scene_rotator(scene)
+        if replace_org_file or save_rotated:
+            export_rotated(scene, glb_path, replace_org_file)
+
+    if face_budget is not None:
+        # No-op for a LOD already under budget
+        scene = decimate_scene(scene, face_budget)
     
     # Compute the center and size of the object's bounding box
     center = scene.bounding_box.centroid
     size = np.max(scene.bounding_box.extents)
     # Set camera distance (adjustable, relative to object size)
     distance = size * 2.0
-    # Get all vertices in the scene
-    points = np.concatenate([mesh.vertices for mesh in scene.geometry.values()], axis=0)
-    
-    Transforms = []
-    Ks = []
-    render_index = 0
-
-    if mark:
-        # Add axes and center marker to the scene
-        axes = trimesh.creation.axis(origin_size=0.05, axis_length=0.5)
-        scene.add_geometry(axes)
-        center_marker = trimesh.creation.icosphere(
-            radius=0.01, 
-            subdivisions=2,
-            face_colors=[1, 0, 0],
-            )
-        center_marker.apply_translation(np.array([0.5,0.5,0.5]))
-        scene.add_geometry(center_marker)
-
-    # Loop through each combination of azimuth and elevation angles
-    for _, elev in tqdm(enumerate(elevation_angles), desc="Elevation Angles", leave=False):
-        for _, azim in tqdm(enumerate(azimuth_angles), desc="Azimuth Angles", leave=False):
-            # Set the camera transform for the current view
-            # NOTE: The basic euler_x was changed to 90-euler_x 
-            # and the euler_z was changed to 180-euler_z 
-            # to match the camera orientation in Trillis
-            rotation_matrix = trimesh.transformations.quaternion_matrix(
-                    trimesh.transformations.quaternion_from_euler(
-                        np.deg2rad(90 - elev),
-                        np.deg2rad(0),
-                        np.deg2rad(180 - azim),
-                        axes='sxyz'
-                        )
-                    )
-            camera_transform= trimesh.scene.cameras.look_at(
-                points=points,
-                fov=fov_deg,
-                distance=distance,
-                rotation=rotation_matrix,
-                center=center,
-            )
-            scene.camera_transform = camera_transform
 
+    # Every azimuth/elevation pair of the grid, all poses computed in one batch
+    elev_grid, azim_grid = np.meshgrid(elevation_angles, azimuth_angles, indexing='ij')
+    azimuths, elevations = azim_grid.ravel(), elev_grid.ravel()
+    if view_selection == 'adaptive':
+        # Grid pairs come first so that they win ties against the sphere directions
+        sphere_azimuths, sphere_elevations = fibonacci_views(num_candidates)
+        azimuths = np.concatenate([azimuths, sphere_azimuths])
+        elevations = np.concatenate([elevations, sphere_elevations])
+        selected = select_views(scene, center, distance, azimuths, elevations, coverage_target, max_views)
+        if len(selected) == 0:
+            selected = np.arange(elev_grid.size)
+        azimuths, elevations = azimuths[selected], elevations[selected]
+    elif view_selection != 'grid':
+        raise ValueError(f"Unknown view selection: {view_selection}")
+
+    output_files = []
+
+    # Upload the geometry once and reuse it for every view
+    own_renderer = renderer is None
+    if own_renderer:
+        renderer = create_renderer(backend, resolution=resolution)
+    try:
+        renderer.load(scene)
+
+        camera_transforms = camera_poses(center, distance, azimuths, elevations)
+        # Intrinsics of the projection the backend actually draws with
+        K = renderer.K
+
+        if mark:
+            # World axes and the mark point, projected into all views at once
+            mark_uv, mark_depth = project_points(MARK_POINTS, camera_transforms, K)
+
+        for render_index, camera_transform in tqdm(enumerate(camera_transforms), desc="Rendering views", total=len(camera_transforms), leave=False):
             # Render the image in offscreen mode (avoid display dependency)
             render_file = os.path.join(out_dir, f'render_{render_index}.png')
-            render_index += 1
-            window_conf = gl.Config(double_buffer=True, depth_size=24)
-            png = scene.save_image(visible=False, resolution=resolution, window_conf=window_conf)
-            with open(render_file, 'wb') as f:
-                f.write(png)
-            
-            # Save the camera transform and intrinsic matrix
-            camera = scene.camera
-            transform = scene.camera_transform
-            K = camera.K
-            Transforms.append(transform)
-            Ks.append(K)
-
+            if buffers:
+                # RGBA and the auxiliary buffers come out of the same draw
+                passes = renderer.render_passes(camera_transform)
+                rgba = passes['rgba']
+                buffer_file = os.path.join(asset_path, 'buffers', f'render_{render_index}.npz')
+                save_buffers(buffer_file, passes, renderer.instance_names)
+                output_files.append(buffer_file)
+            else:
+                rgba = renderer.render(camera_transform)
             if mark:
-                # Project a mark point to the image and plot it
-                mark_point = np.array([[0.5, 0.5, 0.5]])
-                transformed = transform_points(mark_point, np.linalg.inv(transform))
-                projected = transformed @ K.T
-                # Calculate the homogeneous coordinate
-                xy = projected[:, :2] / projected[:, 2:]
-                xy[:, 0] = scene.camera.resolution[0] - 1 - xy[:, 0]
-
-                image = plt.imread(render_file)
-                plt.imshow(image)
-                plt.scatter(xy[:, 0], xy[:, 1], c='r', s=20)
-                render_file = os.path.join(out_dir, f'render_azim{azim}_elev{elev}_marked.png')
-                plt.savefig(render_file)
-                plt.close()
+                # Drawn into the RGBA buffer, so the view is encoded only once
+                in_front = mark_depth[render_index] > 0
+                axes = in_front[0] & in_front[1:4]
+                draw_marks(
+                    rgba,
+                    segments=mark_uv[render_index][MARK_AXES][axes],
+                    segment_colors=MARK_AXIS_COLORS[axes],
+                    points=mark_uv[render_index][4:][in_front[4:]],
+                    point_colors=MARK_POINT_COLORS[in_front[4:]],
+                )
+            Image.fromarray(rgba).save(render_file)
+            output_files.append(render_file)
 
             # print(f"Rendered view at azimuth {azim}° and elevation {elev}° saved to {render_file}")
-    return Transforms, Ks
+    finally:
+        # Also on failure, long-lived workers must not leak the GL context
+        if own_renderer:
+            renderer.close()
+
+    # Persist the camera rig next to `images/` for downstream stages
+    cameras_file = os.path.join(asset_path, 'cameras.npz')
+    Ks = np.repeat(K[None], len(camera_transforms), axis=0)
+    save_cameras(cameras_file, camera_transforms, Ks, azimuths, elevations, resolution)
+    output_files.append(cameras_file)
+    if cache_dir is not None:
+        cache.store(cache_key, asset_path, [os.path.relpath(f, asset_path) for f in output_files])
+    return list(camera_transforms), list(Ks)
+
+# Renderer owned by a worker process of `render_assets`
+_worker_renderer = None
+
+
+def _init_render_worker(backend: str, resolution: tuple) -> None:
+    """Create the per-process renderer (and GL context) once per worker."""
+    global _worker_renderer
+    _worker_renderer = create_renderer(backend, resolution=resolution)
+
+
+def _render_asset(glb_path: str, render_kwargs: dict, renderer: Renderer = None):
+    """Render one asset, returning (glb_path, error, timing report) instead of raising."""
+    renderer = _worker_renderer if renderer is None else renderer
+    try:
+        render_views(glb_path=glb_path, renderer=renderer, **render_kwargs)
+        return glb_path, None, renderer.report()
+    except Exception as e:
+        renderer.report()
+        return glb_path, f"{type(e).__name__}: {e}", None
+
+
+def _render_pool(glb_paths: list, num_workers: int, backend: str, resolution: tuple, render_kwargs: dict, log) -> tuple:
+    """
+    Render `glb_paths` in a fresh pool of worker processes, with at most
+    `num_workers` assets in flight so that a dying worker can only have
+    taken those down with the pool.
+
+    Returns:
+        crashed: Assets in flight when a worker process died (the pool is broken then).
+        remaining: Assets not submitted before the pool broke.
+    """
+    remaining = deque(glb_paths)
+    in_flight = {}
+    crashed = []
+    # 'spawn' so that no GL state is inherited from the parent process
+    with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_render_worker,
+            initargs=(backend, resolution),
+        ) as executor:
+        while (len(remaining) > 0 or len(in_flight) > 0) and len(crashed) == 0:
+            while len(remaining) > 0 and len(in_flight) < num_workers:
+                glb_path = remaining.popleft()
+                in_flight[executor.submit(_render_asset, glb_path, render_kwargs)] = glb_path
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                glb_path = in_flight.pop(future)
+                try:
+                    log(future.result())
+                except BrokenProcessPool:
+                    crashed.append(glb_path)
+                except Exception as e:
+                    log((glb_path, f"{type(e).__name__}: {e}", None))
+        # Everything still in flight went down with the broken pool
+        crashed.extend(in_flight.values())
+    return crashed, list(remaining)
+
+
+def render_assets(
+        glb_paths: list,
+        num_workers: int = 1,
+        backend: str = 'gl',
+        **render_kwargs,
+        ):
+    """
+    Render a batch of assets with `render_views`, optionally in parallel.
+
+    With `num_workers > 1` the assets are distributed over a pool of worker
+    processes, each of which owns its own renderer (GL or software context).
+    A failing asset is reported and skipped, the rest of the batch continues.
+    When a worker process dies (segfault, out of memory in GL...) the pool is
+    respawned for the remaining assets, and the assets that were in flight
+    are rendered again one per pool to find and report the one that crashed.
+
+    Parameters:
+        glb_paths: Paths of the GLB assets to render.
+        num_workers: Number of worker processes, 1 renders in this process.
+        backend: Render backend, 'gl' or 'software'.
+        render_kwargs: Passed to `render_views` (out_dir, angles, resolution...).
+
+    Returns:
+        failures: Dict mapping each failed GLB path to its error message.
+    """
+    resolution = render_kwargs.get('resolution', (800, 600))
+    failures = {}
+
+    progress = tqdm(total=len(glb_paths), desc="Rendering Asset Images")
+
+    def log(result):
+        glb_path, error, report = result
+        if error is None:
+            tqdm.write(f"{os.path.basename(glb_path)}: {report}")
+        else:
+            tqdm.write(f"{os.path.basename(glb_path)}: FAILED ({error})")
+            failures[glb_path] = error
+        progress.update(1)
+
+    if num_workers <= 1:
+        renderer = create_renderer(backend, resolution=resolution)
+        try:
+            for glb_path in glb_paths:
+                log(_render_asset(glb_path, render_kwargs, renderer))
+        finally:
+            renderer.close()
+        progress.close()
+        return failures
+
+    remaining = list(glb_paths)
+    while len(remaining) > 0:
+        crashed, remaining = _render_pool(remaining, num_workers, backend, resolution, render_kwargs, log)
+        for glb_path in crashed:
+            # Alone in its pool, a crash can only come from this asset
+            if len(_render_pool([glb_path], 1, backend, resolution, render_kwargs, log)[0]) > 0:
+                log((glb_path, "BrokenProcessPool: the render worker process died", None))
+    progress.close()
+    return failures
+
 
 if __name__ == '__main__':
     # Example: Render multiple views of the asset from various azimuth and elevation angles
@@ -151,9 +353,18 @@ if __name__ == '__main__':
     args.add_argument("--elevation_angles", type=list, default=[0, 60, -60])
     args.add_argument("--trillis_asset", type=bool, default=True)
     args.add_argument("--replace_org_file", type=bool, default=False)
+    args.add_argument("--save_rotated", type=bool, default=False)
     args.add_argument("--fov_deg", type=float, default=60)
     args.add_argument("--resolution", type=tuple, default=(800, 600))
     args.add_argument("--mark", type=bool, default=False)
+    args.add_argument("--buffers", type=bool, default=False)
+    args.add_argument("--backend", type=str, default="gl", choices=["gl", "software"])
+    args.add_argument("--cache_dir", type=str, default=None)
+    args.add_argument("--mesh_cache_dir", type=str, default=None)
+    args.add_argument("--face_budget", type=int, default=None)
+    args.add_argument("--view_selection", type=str, default="grid", choices=["grid", "adaptive"])
+    args.add_argument("--coverage_target", type=float, default=0.95)
+    args.add_argument("--max_views", type=int, default=9)
     args = args.parse_args()
 
 
@@ -165,7 +376,16 @@ if __name__ == '__main__':
         elevation_angles=args.elevation_angles,
         trillis_asset=args.trillis_asset,
         replace_org_file=args.replace_org_file,
+        save_rotated=args.save_rotated,
         fov_deg=args.fov_deg,
         resolution=args.resolution,
         mark=args.mark,
+        buffers=args.buffers,
+        backend=args.backend,
+        cache_dir=args.cache_dir,
+        mesh_cache_dir=args.mesh_cache_dir,
+        face_budget=args.face_budget,
+        view_selection=args.view_selection,
+        coverage_target=args.coverage_target,
+        max_views=args.max_views,
     )
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+import time
+import argparse
+import cv2
+import torch
+import numpy as np
+from omegaconf import OmegaConf
+from asset_segmentation import BatchedMaskGenerator, build_segmentation_model
+from utils.sam_utils import configure_cpu, pairwise_intersection, seed_everything
+
+
+def load_views(renders_path: str, max_views: int = None) -> list:
+    """RGB images of the rendered views of every asset in `renders_path`."""
+    views = []
+    for asset in sorted(os.listdir(renders_path)):
+        img_folder = os.path.join(renders_path, asset, 'images')
+        if not os.path.isdir(img_folder):
+            continue
+        for data_path in sorted(os.listdir(img_folder)):
+            views.append(cv2.cvtColor(cv2.imread(os.path.join(img_folder, data_path)), cv2.COLOR_BGR2RGB))
+    return views[:max_views]
+
+
+def mask_agreement(reference: list, masks: list) -> np.ndarray:
+    """Best IoU of every reference mask with any of `masks` (0 if there are none)."""
+    if len(reference) == 0:
+        return np.zeros(0)
+    if len(masks) == 0:
+        return np.zeros(len(reference))
+    stacked = torch.from_numpy(np.stack([m['segmentation'] for m in reference + masks]))
+    intersection = pairwise_intersection(stacked)[:len(reference), len(reference):]
+    area = stacked.flatten(1).sum(1).float()
+    union = area[:len(reference), None] + area[None, len(reference):] - intersection
+    return (intersection / union).max(dim=1).values.numpy()
+
+
+def benchmark(views: list, model_cfg: str, sam2_checkpoint: str, precision: str, generator_kwargs: dict, batch_size: int):
+    """Masks of every view and the masks/s of SAM2 on the CPU with the encoder in `precision`."""
+    seed_everything(42)
+    sam2 = build_segmentation_model(model_cfg, sam2_checkpoint, device='cpu', cpu_precision=precision)
+    mask_generator = BatchedMaskGenerator(model=sam2, **generator_kwargs)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        mask_generator.encode_batch(views, batch_size=batch_size)
+        masks = [mask_generator.generate(view) for view in views]
+    elapsed = time.perf_counter() - start
+    return masks, sum(len(m) for m in masks) / elapsed, len(views) / elapsed
+
+
+if __name__ == '__main__':
+    # Example: compare the CPU precisions on the test renders (run from Material/)
+    args = argparse.ArgumentParser()
+    args.add_argument("--renders_path", type=str, default="../assets/test_renders")
+    args.add_argument("--config", type=str, default="config/config.yaml")
+    args.add_argument("--precisions", type=str, nargs="+", default=["fp32", "bf16", "int8"])
+    args.add_argument("--num_threads", type=int, default=None)
+    args.add_argument("--max_views", type=int, default=None)
+    args = args.parse_args()
+
+    config = OmegaConf.load(args.config).SEGMENTATION
+    generator_kwargs = dict(
+        points_per_side=config.points_per_side,
+        points_per_batch=config.points_per_batch,
+        pred_iou_thresh=config.pred_iou_thresh,
+        stability_score_thresh=config.stability_score_thresh,
+        stability_score_offset=config.stability_score_offset,
+        crop_n_layers=config.crop_n_layers,
+        box_nms_thresh=config.box_nms_thresh,
+        crop_n_points_downscale_factor=config.crop_n_points_downscale_factor,
+        min_mask_region_area=config.min_mask_region_area,
+        use_m2m=config.use_m2m,
+    )
+    configure_cpu(num_threads=args.num_threads)
+    views = load_views(args.renders_path, args.max_views)
+    print(f"{len(views)} views, {torch.get_num_threads()} threads")
+
+    # fp32 is the reference of the mask agreement
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    reference = None
+    for precision in precisions:
+        masks, masks_per_s, views_per_s = benchmark(
+            views, config.model_cfg, config.sam2_checkpoint, precision, generator_kwargs, config.encoder_batch_size,
+        )
+        if reference is None:
+            reference = masks
+        best_iou = np.concatenate([mask_agreement(r, m) for r, m in zip(reference, masks)])
+        print(f"{precision}: {masks_per_s:.2f} masks/s, {views_per_s:.3f} views/s, "
+              f"mean best IoU {best_iou.mean() if len(best_iou) else float('nan'):.4f}, "
+              f"matched (IoU >= 0.9) {(best_iou >= 0.9).mean() if len(best_iou) else float('nan'):.1%}")
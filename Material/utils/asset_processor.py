@@ -1,137 +1,208 @@
 import os
+import glob
+import json
+import time
+import struct
+import shutil
+import tempfile
 import trimesh
 import numpy as np
 from scipy.spatial.transform import Rotation as R
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from utils.mesh_utils import MeshCache, load_scene
 
-def extract_submeshes(file_path):
-    output_dir = "assets/sub_meshes"
+def _read_obj(file_path):
+    """
+    Read an OBJ file in a single pass.
+
+    Returns:
+        Dict with the raw `v`, `vt`, `vn` and `mtllib` lines and `groups`, the
+        face lines of every `o`/`g` block by name (a repeated name keeps only
+        its last block, faces before the first `o`/`g` belong to no submesh).
+    """
+    obj = {'v': [], 'vt': [], 'vn': [], 'mtllib': [], 'groups': {}}
+    face_lines = None
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key = line[:2]
+            if key == 'v ':
+                obj['v'].append(line)
+            elif key == 'f ':
+                if face_lines is not None:
+                    face_lines.append(line)
+            elif key == 'vt' or key == 'vn':
+                if line[2:3] == ' ':
+                    obj[key].append(line)
+            elif key == 'o ' or key == 'g ':
+                parts = line.strip().split()
+                face_lines = obj['groups'][parts[1] if len(parts) > 1 else "unnamed"] = []
+            elif key == 'mt' and line.startswith('mtllib'):
+                obj['mtllib'].append(line)
+    return obj
+
+
+_WHITESPACE = np.isin(np.arange(256), list(b' \t\n\r\x0b\x0c'))
+
+
+def _tokens(text):
+    """Byte view of `text` and the start/end offsets of its whitespace separated tokens."""
+    buffer = np.frombuffer(text, dtype=np.uint8)
+    solid = np.zeros(len(buffer) + 2, dtype=np.int8)
+    solid[1:-1] = ~_WHITESPACE[buffer]
+    edges = np.diff(solid)
+    return buffer, np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _parse_numbers(text, dtype, count):
+    """Parse `count` whitespace separated numbers from `text` in one call."""
+    values = np.fromstring(text, dtype=dtype, sep=' ')
+    if len(values) != count:
+        raise ValueError(f"Malformed OBJ data: expected {count} numbers, parsed {len(values)}")
+    return values
+
+
+def _parse_vertices(vertex_lines):
+    """(N, 3) float64 coordinates of `v` lines (extra components such as colours are ignored)."""
+    text = ''.join(line[2:] for line in vertex_lines).encode('utf-8')
+    buffer, starts, ends = _tokens(text)
+    if len(starts) == 3 * len(vertex_lines):
+        return _parse_numbers(text, np.float64, len(starts)).reshape(-1, 3)
+
+    # Lines with more than three components: keep the first three of every line
+    line_of = np.searchsorted(np.flatnonzero(buffer == ord('\n')), starts)
+    first = np.flatnonzero(np.diff(np.concatenate([[-1], line_of])))
+    if len(first) != len(vertex_lines) or (np.diff(np.append(first, len(starts))) < 3).any():
+        raise ValueError("Malformed OBJ data: vertex with fewer than three coordinates")
+    tokens = (first[:, None] + np.arange(3)).ravel()
+    text = b' '.join(text[a:b] for a, b in zip(starts[tokens].tolist(), ends[tokens].tolist()))
+    return _parse_numbers(text, np.float64, len(tokens)).reshape(-1, 3)
+
+
+def _parse_faces(face_lines):
+    """
+    Parse `f` lines into arrays.
+
+    Returns:
+        keyword: Boolean mask of the `f` tokens among all tokens.
+        indices: (N, 3) int64 v/vt/vn indices of every face corner, 0 where
+            a component is empty (e.g. `1//3`).
+    """
+    text = ''.join(face_lines).encode('utf-8')
+    buffer, starts, _ = _tokens(text)
+    keyword = buffer[starts] == ord('f')
+    components = np.add.reduceat(buffer == ord('/'), starts, dtype=np.int64)[~keyword] + 1
+
+    # Blank out the keywords and fill empty components with 0, so that every
+    # corner parses to exactly `components` integers
+    body = buffer.copy()
+    body[starts[keyword]] = ord(' ')
+    text = b' ' + body.tobytes() + b' '
+    text = text.replace(b'//', b'/0/').replace(b'//', b'/0/')
+    text = text.replace(b'\n', b' ').replace(b'\t', b' ').replace(b' /', b' 0/').replace(b'/ ', b'/0 ')
+    values = _parse_numbers(text.replace(b'/', b' '), np.int64, int(components.sum()))
+
+    first = np.cumsum(components) - components
+    indices = np.zeros((len(components), 3), dtype=np.int64)
+    for j in range(3):
+        has = components > j
+        indices[has, j] = values[first[has] + j]
+    return keyword, indices
+
+
+def _reindex(indices):
+    """Sorted used (non-zero) indices and the 1-based new index of every entry, 0 stays empty."""
+    used = indices != 0
+    if not used.any():
+        return indices[used], indices
+    # Dense lookup table, equivalent to np.unique(return_inverse=True) on bounded indices
+    low = indices[used].min()
+    present = np.zeros(indices[used].max() - low + 1, dtype=bool)
+    present[indices[used] - low] = True
+    new = np.zeros_like(indices)
+    new[used] = np.cumsum(present)[indices[used] - low]
+    return np.flatnonzero(present) + low, new
+
+
+# Corner layout by (v, vt, vn) presence, as written by the original line-based code
+_CORNER_FORMATS = np.array([' ', ' //%d', ' /%d', ' /%d/%d', ' %d', ' %d//%d', ' %d/%d', ' %d/%d/%d'], dtype=object)
+
+
+def _format_faces(keyword, indices, chunk_size=2 ** 16):
+    """Yield OBJ `f` lines for the parsed faces in chunks, same layout as the input."""
+    has = indices != 0
+    codes = has[:, 0] * 4 + has[:, 1] * 2 + has[:, 2]
+    starts = np.flatnonzero(keyword)
+    corners_before = np.concatenate([[0], np.cumsum(~keyword)])
+    for i in range(0, len(starts), chunk_size):
+        t0 = starts[i]
+        t1 = starts[i + chunk_size] if i + chunk_size < len(starts) else len(keyword)
+        c0, c1 = corners_before[t0], corners_before[t1]
+        pieces = np.empty(t1 - t0, dtype=object)
+        pieces[keyword[t0:t1]] = '\nf'
+        pieces[~keyword[t0:t1]] = _CORNER_FORMATS[codes[c0:c1]]
+        yield (''.join(pieces.tolist())[1:] + '\n') % tuple(indices[c0:c1][has[c0:c1]].tolist())
+
+
+def _format_vertices(vertices, chunk_size=2 ** 16):
+    """Yield OBJ `v` lines in chunks, numbers printed like Python's `f"v {x} {y} {z}"`."""
+    for start in range(0, len(vertices), chunk_size):
+        chunk = vertices[start:start + chunk_size]
+        yield ("v %r %r %r\n" * len(chunk)) % tuple(chunk.ravel().tolist())
+
+
+def extract_submeshes(file_path, cache_dir=None, output_dir="assets/sub_meshes", verbose=True):
+    """
+    Write every submesh of an OBJ/GLB file, normalized to the unit cube, as
+    `<output_dir>/<name>.obj` and return the written paths. Batches should
+    give every file its own `output_dir`, submesh names repeat across assets.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    output_files = []
     
     if file_path.lower().endswith('.obj'):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        # Global vertex, texture, normal definitions (note: indices start from 1)
-        vertices = [line for line in lines if line.startswith('v ')]
-        textures = [line for line in lines if line.startswith('vt ')]
-        normals  = [line for line in lines if line.startswith('vn ')]
-        
-        # Divide by submesh based on "o" or "g" tags
-        submesh_data = {}
-        current_name = None
-        current_lines = []
-        for line in lines:
-            if line.startswith("o ") or line.startswith("g "):
-                if current_name is not None:
-                    submesh_data[current_name] = current_lines
-                parts = line.strip().split()
-                current_name = parts[1] if len(parts) > 1 else "unnamed"
-                current_lines = [line]
-            else:
-                if current_name is not None:
-                    current_lines.append(line)
-        if current_name is not None:
-            submesh_data[current_name] = current_lines
+        # Global vertex, texture, normal definitions (note: indices start from 1) and submeshes by "o"/"g" tag
+        obj = _read_obj(file_path)
+        vertices = _parse_vertices(obj['v'])
+        textures, normals = obj['vt'], obj['vn']
 
         # Process each submesh: extract used vertices, textures, normals and reindex, normalize vertices to unit space and center the origin
-        for name, sub_lines in submesh_data.items():
-            used_v = set()
-            used_vt = set()
-            used_vn = set()
-            face_lines = []
-            for line in sub_lines:
-                if line.startswith("f "):
-                    face_lines.append(line)
-                    parts = line.strip().split()[1:]
-                    for part in parts:
-                        indices = part.split('/')
-                        if indices[0]:
-                            used_v.add(int(indices[0]))
-                        if len(indices) > 1 and indices[1]:
-                            used_vt.add(int(indices[1]))
-                        if len(indices) > 2 and indices[2]:
-                            used_vn.add(int(indices[2]))
-            
-            # Extract used vertex coordinates
-            sub_vertices_coords = {}
-            for idx in sorted(used_v):
-                try:
-                    v_line = vertices[idx - 1].strip()  # Format: "v x y z"
-                    parts = v_line.split()
-                    x, y, z = map(float, parts[1:4])
-                    sub_vertices_coords[idx] = (x, y, z)
-                except IndexError:
-                    pass
-            
-            # Calculate bounding box and longest edge
-            xs = [coord[0] for coord in sub_vertices_coords.values()]
-            ys = [coord[1] for coord in sub_vertices_coords.values()]
-            zs = [coord[2] for coord in sub_vertices_coords.values()]
-            min_x, max_x = min(xs), max(xs)
-            min_y, max_y = min(ys), max(ys)
-            min_z, max_z = min(zs), max(zs)
-            scale = max(max_x - min_x, max_y - min_y, max_z - min_z)
-            
-            # Create normalized vertices: translate and normalize, then move origin to center (-0.5 offset)
-            normalized_vertices = {}
-            for idx, (x, y, z) in sub_vertices_coords.items():
-                x_norm = (x - min_x) / scale - 0.5
-                y_norm = (y - min_y) / scale - 0.5
-                z_norm = (z - min_z) / scale - 0.5
-                normalized_vertices[idx] = f"v {x_norm} {y_norm} {z_norm}\n"
-            
+        for name, face_lines in obj['groups'].items():
+            if len(face_lines) == 0:
+                if verbose:
+                    print(f"Skipped submesh {name}: no faces")
+                continue
+            keyword, indices = _parse_faces(face_lines)
+            obj['groups'][name] = None
+
             # Create old index -> new index mapping (sorted in ascending order)
-            v_map  = {old: new for new, old in enumerate(sorted(used_v), start=1)}
-            vt_map = {old: new for new, old in enumerate(sorted(used_vt), start=1)}
-            vn_map = {old: new for new, old in enumerate(sorted(used_vn), start=1)}
+            used_v, indices[:, 0] = _reindex(indices[:, 0])
+            used_vt, indices[:, 1] = _reindex(indices[:, 1])
+            used_vn, indices[:, 2] = _reindex(indices[:, 2])
+
+            # Normalize the used vertices by the longest bounding box edge, then move origin to center (-0.5 offset)
+            coords = vertices[used_v - 1]
+            min_bounds = coords.min(axis=0)
+            scale = (coords.max(axis=0) - min_bounds).max()
+            normalized_vertices = (coords - min_bounds) / scale - 0.5
 
             out_file = os.path.join(output_dir, f"{name}.obj")
             with open(out_file, 'w', encoding='utf-8') as fout:
                 # Write material library declaration if present in the original file
-                for line in lines:
-                    if line.startswith("mtllib"):
-                        fout.write(line)
-                # Output normalized vertices
-                for idx in sorted(used_v):
-                    try:
-                        fout.write(normalized_vertices[idx])
-                    except IndexError:
-                        pass
-                for idx in sorted(used_vt):
-                    try:
-                        fout.write(textures[idx - 1])
-                    except IndexError:
-                        pass
-                for idx in sorted(used_vn):
-                    try:
-                        fout.write(normals[idx - 1])
-                    except IndexError:
-                        pass
+                fout.writelines(obj['mtllib'])
+                # Output normalized vertices, then the used texture and normal lines as they are
+                fout.writelines(_format_vertices(normalized_vertices))
+                fout.writelines([textures[i - 1] for i in used_vt.tolist() if -len(textures) <= i - 1 < len(textures)])
+                fout.writelines([normals[i - 1] for i in used_vn.tolist() if -len(normals) <= i - 1 < len(normals)])
                 fout.write(f"o {name}\n")
-                for line in face_lines:
-                    parts = line.strip().split()
-                    new_face = "f"
-                    for part in parts[1:]:
-                        indices = part.split('/')
-                        v_new = vt_new = vn_new = ""
-                        if indices[0]:
-                            v_new = str(v_map[int(indices[0])])
-                        if len(indices) > 1 and indices[1]:
-                            vt_new = str(vt_map[int(indices[1])])
-                        if len(indices) > 2 and indices[2]:
-                            vn_new = str(vn_map[int(indices[2])])
-                        new_vertex = v_new
-                        if vt_new or vn_new:
-                            new_vertex += "/" + vt_new
-                        if vn_new:
-                            new_vertex += "/" + vn_new
-                        new_face += " " + new_vertex
-                    fout.write(new_face + "\n")
-            print(f"Saved submesh {name} to file: {out_file}")
+                fout.writelines(_format_faces(keyword, indices))
+            output_files.append(out_file)
+            if verbose:
+                print(f"Saved submesh {name} to file: {out_file}")
     
     elif file_path.lower().endswith('.glb'):
-        # Use trimesh to load glb file, normalize each submesh separately and export
-        scene = trimesh.load(file_path, force='scene')
+        # Use trimesh to load glb file (through the mesh cache if given), normalize each submesh separately and export
+        scene = load_scene(file_path, cache_dir=cache_dir)
         for name, geom in scene.geometry.items():
             vertices = geom.vertices
             faces = geom.faces
@@ -145,107 +216,129 @@ def extract_submeshes(file_path):
             new_mesh = trimesh.Trimesh(vertices=normalized_vertices, faces=faces)
             out_file = os.path.join(output_dir, f"{name}.obj")
             new_mesh.export(out_file)
-            print(f"Saved submesh {name} to file: {out_file}")
+            output_files.append(out_file)
+            if verbose:
+                print(f"Saved submesh {name} to file: {out_file}")
     else:
         print("Unsupported file format")
+    return output_files
 
-def merge_submeshes(file_path):
-    os.makedirs("assets/merge_meshes", exist_ok=True)
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+def _parse_vertex_chunk(vertex_lines):
+    """Coordinates of `v` lines, NaN rows for lines with fewer than three components."""
+    try:
+        return _parse_vertices(vertex_lines)
+    except ValueError:
+        coords = np.full((len(vertex_lines), 3), np.nan)
+        for i, line in enumerate(vertex_lines):
+            parts = line.strip().split()
+            if len(parts) >= 4:
+                coords[i] = [float(part) for part in parts[1:4]]
+        return coords
+
+
+def merge_submeshes(file_path, chunk_bytes=2 ** 22, output_dir="assets/merge_meshes", verbose=True):
+    """
+    Merge all submeshes of an OBJ file into one normalized object, written
+    to `<output_dir>/<name>_merge.obj` (returned).
+
+    The file is streamed twice in chunks of about `chunk_bytes`, so memory
+    stays bounded regardless of its size: the first pass computes the
+    bounding box, the second writes the normalized vertices and spools the
+    `vt`, `vn` and `f` lines to temporary files that are appended afterwards.
+    """
+    os.makedirs(output_dir, exist_ok=True)
 
+    # Pass 1: material libraries and bounding box of the vertex coordinates
     mtllib_lines = []
-    vertex_lines = []
-    texture_lines = []
-    normal_lines = []
-    face_lines = []
-    
-    for line in lines:
-        if line.startswith("mtllib"):
-            mtllib_lines.append(line)
-        elif line.startswith("v "):
-            vertex_lines.append(line)
-        elif line.startswith("vt "):
-            texture_lines.append(line)
-        elif line.startswith("vn "):
-            normal_lines.append(line)
-        elif line.startswith("f "):
-            face_lines.append(line)
-    
-    # Parse vertex coordinates to calculate bounding box
-    vertices_coords = []
-    for line in vertex_lines:
-        parts = line.strip().split()
-        if len(parts) < 4:
-            continue
-        x, y, z = map(float, parts[1:4])
-        vertices_coords.append((x, y, z))
-        
-    if not vertices_coords:
+    min_bounds, max_bounds = np.full(3, np.inf), np.full(3, -np.inf)
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for lines in iter(lambda: f.readlines(chunk_bytes), []):
+            mtllib_lines += [line for line in lines if line.startswith("mtllib")]
+            coords = _parse_vertex_chunk([line for line in lines if line.startswith("v ")])
+            coords = coords[~np.isnan(coords).any(axis=1)]
+            if len(coords) > 0:
+                min_bounds = np.minimum(min_bounds, coords.min(axis=0))
+                max_bounds = np.maximum(max_bounds, coords.max(axis=0))
+
+    if not np.isfinite(min_bounds).all():
         print("No vertex data found")
         return
-    
-    xs = [coord[0] for coord in vertices_coords]
-    ys = [coord[1] for coord in vertices_coords]
-    zs = [coord[2] for coord in vertices_coords]
-    min_x, max_x = min(xs), max(xs)
-    min_y, max_y = min(ys), max(ys)
-    min_z, max_z = min(zs), max(zs)
-    scale = max(max_x - min_x, max_y - min_y, max_z - min_z)
-    
-    # Normalize vertices: translate and normalize, then center the origin (-0.5 offset)
-    normalized_vertex_lines = []
-    for line in vertex_lines:
-        parts = line.strip().split()
-        if len(parts) < 4:
-            normalized_vertex_lines.append(line)
-        else:
-            x, y, z = map(float, parts[1:4])
-            x_norm = (x - min_x) / scale - 0.5
-            y_norm = (y - min_y) / scale - 0.5
-            z_norm = (z - min_z) / scale - 0.5
-            normalized_vertex_lines.append(f"v {x_norm} {y_norm} {z_norm}\n")
-            
-    merged_file = os.path.join("assets/merge_meshes", f"{os.path.basename(file_path).split('.')[0]}_merge.obj")
-    with open(merged_file, 'w', encoding='utf-8') as fout:
-        # Output material library declaration (if present)
-        for line in mtllib_lines:
-            fout.write(line)
-        # Output normalized vertex data
-        for v_line in normalized_vertex_lines:
-            fout.write(v_line)
-        # Output texture and normal data (keep original order)
-        for vt_line in texture_lines:
-            fout.write(vt_line)
-        for vn_line in normal_lines:
-            fout.write(vn_line)
-        # Output merged object name
-        fout.write("o merged\n")
-        # Output all face data (merge all submeshes together)
-        for f_line in face_lines:
-            fout.write(f_line)
-    print(f"Merged file saved as: {merged_file}")
+    scale = (max_bounds - min_bounds).max()
 
-def glb_asset_rotator(file_path,
-                      euler_x: float = 90.0,
-                      euler_y: float = 0.0,
-                      euler_z: float = 180.0,
-                      replace_org_file: bool = False):
-    # Load the GLB file
-    scene = trimesh.load(file_path, force='scene')
+    # Pass 2: normalized vertices go straight to the output, the rest is spooled to keep the section order
+    merged_file = os.path.join(output_dir, f"{os.path.basename(file_path).split('.')[0]}_merge.obj")
+    spools = {key: tempfile.TemporaryFile('w+', encoding='utf-8', dir=output_dir) for key in ("vt ", "vn ", "f ")}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f, open(merged_file, 'w', encoding='utf-8') as fout:
+            # Output material library declaration (if present)
+            fout.writelines(mtllib_lines)
+            for lines in iter(lambda: f.readlines(chunk_bytes), []):
+                vertex_lines = []
+                for line in lines:
+                    if line.startswith("v "):
+                        vertex_lines.append(line)
+                    elif line[:3] in spools:
+                        spools[line[:3]].write(line)
+                    elif line.startswith("f "):
+                        spools["f "].write(line)
 
+                # Normalize vertices: translate and normalize, then center the origin (-0.5 offset)
+                coords = _parse_vertex_chunk(vertex_lines)
+                normalized = (coords - min_bounds) / scale - 0.5
+                valid = ~np.isnan(coords).any(axis=1)
+                if valid.all():
+                    fout.writelines(_format_vertices(normalized))
+                else:
+                    fout.writelines(
+                        "v %r %r %r\n" % tuple(row) if ok else line
+                        for line, row, ok in zip(vertex_lines, normalized.tolist(), valid.tolist())
+                    )
+
+            # Output texture and normal data (keep original order), the merged object name and all faces
+            for key in ("vt ", "vn "):
+                spools[key].seek(0)
+                shutil.copyfileobj(spools[key], fout)
+            fout.write("o merged\n")
+            spools["f "].seek(0)
+            shutil.copyfileobj(spools["f "], fout)
+    finally:
+        for spool in spools.values():
+            spool.close()
+    if verbose:
+        print(f"Merged file saved as: {merged_file}")
+    return merged_file
+
+def scene_rotator(scene: trimesh.Scene,
+                  euler_x: float = 90.0,
+                  euler_y: float = 0.0,
+                  euler_z: float = 180.0) -> trimesh.Scene:
+    """Rotate every geometry of a loaded scene in memory (no file is written)."""
     # Create a rotation matrix from Euler angles
     rotation = R.from_euler('xyz', [euler_x, euler_y, euler_z], degrees=True).as_matrix()
     transform = np.eye(4)
     transform[:3, :3] = rotation
-    
+
     for name, geom in scene.geometry.items():
         geom.apply_transform(transform)
+    return scene
 
-    # Save the rotated scene back to the file
+def glb_asset_rotator(file_path,
+                      euler_x: float = 90.0,
+                      euler_y: float = 0.0,
+                      euler_z: float = 180.0,
+                      replace_org_file: bool = False,
+                      cache_dir: str = None,
+                      output_dir: str = None):
+    # Load the GLB file (through the mesh cache if given)
+    scene = load_scene(file_path, cache_dir=cache_dir)
+    scene = scene_rotator(scene, euler_x, euler_y, euler_z)
+
+    # Save the rotated scene back to the file, or next to it (in output_dir if given)
     if not replace_org_file:
         output_file = os.path.splitext(file_path)[0] + '_rotated.glb'
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            output_file = os.path.join(output_dir, os.path.basename(output_file))
         scene.export(output_file)
         # print(f"Rotated asset saved to file: {output_file}")
         return output_file
@@ -256,11 +349,309 @@ def glb_asset_rotator(file_path,
         return output_file
 
 
+# Default face budget of the LOD of every consumer: rendering 800x600 views,
+# rigid collision geometry and MPM particle sampling
+LOD_BUDGETS = {'render': 200000, 'collision': 20000, 'mpm': 50000}
+
+
+def _lod_method() -> str:
+    """Quadric decimation when `fast_simplification` is installed, vertex clustering otherwise."""
+    try:
+        import fast_simplification
+        return 'quadric'
+    except ImportError:
+        return 'cluster'
+
+
+def _cluster_decimate(mesh: trimesh.Trimesh, face_count: int) -> trimesh.Trimesh:
+    """Vertex clustering on a uniform grid, coarsened until at most `face_count` faces remain."""
+    vertices, faces = np.asarray(mesh.vertices), np.asarray(mesh.faces)
+    origin = vertices.min(axis=0)
+    # A surface of area A sampled with cells of size c keeps roughly 2 A / c^2 faces,
+    # start finer than that since thin or folded parts collapse faster
+    cell = max(0.25 * np.sqrt(2.0 * mesh.area / max(face_count, 1)), 1e-12)
+    while True:
+        keys = np.floor((vertices - origin) / cell).astype(np.int64)
+        dims = keys.max(axis=0) + 1
+        _, cluster = np.unique((keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2], return_inverse=True)
+        new_faces = cluster[faces]
+        new_faces = new_faces[
+            (new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2]) & (new_faces[:, 0] != new_faces[:, 2])
+        ]
+        # Drop duplicated triangles but keep the winding of the first one
+        _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+        new_faces = new_faces[np.sort(first)]
+        if len(new_faces) <= face_count:
+            break
+        cell *= 1.15
+
+    counts = np.bincount(cluster)
+    new_vertices = np.zeros((len(counts), 3))
+    np.add.at(new_vertices, cluster, vertices)
+    new_vertices /= counts[:, None]
+    simplified = trimesh.Trimesh(vertices=new_vertices, faces=new_faces, process=False)
+    simplified.remove_unreferenced_vertices()
+    return simplified
+
+
+def _transfer_visual(source: trimesh.Trimesh, target: trimesh.Trimesh, texture: bool = True) -> trimesh.Trimesh:
+    """
+    Carry the visual of `source` over to its simplified `target`.
+
+    Vertex colours come from the nearest source vertex. UVs are taken per
+    face corner through the barycentric coordinates of the source face
+    nearest to the face centroid, then averaged over the corners of a vertex
+    that fall in the same texture chart: vertices are only split along the
+    UV seams, the rest of the surface stays welded (and smooth-shaded).
+    With `texture=False` the UVs are dropped and the welded topology of
+    `target` is kept as is.
+    """
+    from scipy.spatial import cKDTree
+
+    visual = source.visual
+    if visual.kind is None or len(target.faces) == 0:
+        return target
+    if visual.kind != 'texture':
+        _, nearest = cKDTree(source.vertices).query(target.vertices)
+        target.visual = trimesh.visual.ColorVisuals(vertex_colors=np.asarray(visual.vertex_colors)[nearest])
+        return target
+    if visual.uv is None or not texture:
+        target.visual = trimesh.visual.TextureVisuals(material=visual.material)
+        return target
+
+    _, nearest = cKDTree(source.triangles_center).query(target.triangles_center)
+    corners = np.asarray(target.faces).reshape(-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Degenerate source faces give NaN coordinates, zeroed below
+        barycentric = trimesh.triangles.points_to_barycentric(
+            np.repeat(source.triangles[nearest], 3, axis=0), np.asarray(target.vertices)[corners]
+        )
+    corner_uv = np.einsum('ij,ijk->ik', np.nan_to_num(barycentric), np.repeat(np.asarray(visual.uv)[source.faces[nearest]], 3, axis=0))
+
+    # Source vertices are split along the UV seams, so its edge-connected faces are the texture charts
+    chart = trimesh.graph.connected_component_labels(source.face_adjacency, node_count=len(source.faces))
+    _, split = np.unique(np.stack([corners, np.repeat(chart[nearest], 3)], axis=1), axis=0, return_inverse=True)
+    split = split.reshape(-1)
+    counts = np.bincount(split)
+    uv = np.zeros((len(counts), 2))
+    np.add.at(uv, split, corner_uv)
+    uv /= counts[:, None]
+    vertex = np.zeros(len(counts), dtype=np.int64)
+    vertex[split] = corners
+    return trimesh.Trimesh(
+        vertices=np.asarray(target.vertices)[vertex],
+        faces=split.reshape(-1, 3),
+        visual=trimesh.visual.TextureVisuals(uv=uv, material=visual.material),
+        process=False,
+    )
+
+
+def decimate_mesh(mesh: trimesh.Trimesh, face_count: int, texture: bool = True) -> trimesh.Trimesh:
+    """
+    Simplify `mesh` to about `face_count` faces, keeping its colours and, with
+    `texture`, its UVs (see `_transfer_visual`). Without `texture` the result
+    keeps the welded topology of the simplifier (collision and MPM LODs).
+    """
+    if len(mesh.faces) <= face_count:
+        return mesh
+    if _lod_method() == 'quadric':
+        # Writable copies: the simplifier rejects the read-only arrays of memory-mapped cache entries
+        welded = trimesh.Trimesh(
+            vertices=np.array(mesh.vertices, dtype=np.float64),
+            faces=np.array(mesh.faces, dtype=np.int64),
+            process=False,
+        )
+        # Weld the UV seams first, otherwise the simplifier tears the surface apart along them
+        welded.merge_vertices(merge_tex=True, merge_norm=True)
+        simplified = welded.simplify_quadric_decimation(face_count=face_count)
+        if len(simplified.faces) > 1.05 * face_count:
+            # The simplifier stops early on some non-manifold meshes
+            simplified = _cluster_decimate(simplified, face_count)
+    else:
+        simplified = _cluster_decimate(mesh, face_count)
+    return _transfer_visual(mesh, simplified, texture=texture)
+
+
+def decimate_scene(scene: trimesh.Scene, face_budget: int, texture: bool = True) -> trimesh.Scene:
+    """Decimate the geometries of `scene` in place, sharing `face_budget` in proportion to their face counts."""
+    meshes = {name: g for name, g in scene.geometry.items() if isinstance(g, trimesh.Trimesh)}
+    total = sum(len(g.faces) for g in meshes.values())
+    if total <= face_budget:
+        return scene
+    for name, geometry in meshes.items():
+        scene.geometry[name] = decimate_mesh(geometry, max(int(face_budget * len(geometry.faces) / total), 4), texture=texture)
+    return scene
+
+
+def lod_file(file_path: str,
+             consumer: str = 'render',
+             face_budget: int = None,
+             cache_dir: str = "mesh_cache") -> str:
+    """
+    Path of the level of detail of `file_path` for `consumer` ('render',
+    'collision' or 'mpm', see `LOD_BUDGETS`) with at most about `face_budget`
+    faces. LODs are built once and cached under `<cache_dir>/lods/`, in the
+    format of the source file; assets already under budget return `file_path`.
+    Only the render LOD is textured, the simulation LODs keep the welded
+    (watertight) surface of the simplifier.
+    """
+    face_budget = LOD_BUDGETS[consumer] if face_budget is None else int(face_budget)
+    extension = os.path.splitext(file_path)[1].lower()
+    entry = os.path.join(cache_dir, 'lods', f"{MeshCache.key(file_path)}-{_lod_method()}-{consumer}-{face_budget}")
+    output_file = os.path.join(entry, f"lod{extension}")
+    if os.path.exists(output_file):
+        return output_file
+    if os.path.exists(os.path.join(entry, 'full')):
+        return file_path
+
+    scene = load_scene(file_path, cache_dir=cache_dir)
+    full = sum(len(g.faces) for g in scene.geometry.values() if isinstance(g, trimesh.Trimesh)) <= face_budget
+    if not full:
+        scene = decimate_scene(scene, face_budget, texture=consumer == 'render')
+    tmp_entry = f"{entry}.tmp-{os.getpid()}"
+    os.makedirs(tmp_entry, exist_ok=True)
+    if full:
+        # Remember that this asset needs no LOD for this budget
+        open(os.path.join(tmp_entry, 'full'), 'w').close()
+        result = file_path
+    else:
+        scene.export(os.path.join(tmp_entry, f"lod{extension}"))
+        result = output_file
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another worker built the same LOD first
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    return result
+
+
+def load_lod(file_path: str, face_budget: int, cache_dir: str = None) -> trimesh.Scene:
+    """Load `file_path` decimated to `face_budget` faces, through the LOD and mesh caches if `cache_dir` is set."""
+    if cache_dir is None:
+        return decimate_scene(load_scene(file_path), face_budget)
+    return load_scene(lod_file(file_path, face_budget=face_budget, cache_dir=cache_dir), cache_dir=cache_dir)
+
+
+
+# File types accepted by every batch command
+BATCH_EXTENSIONS = {'extract': ('.obj', '.glb'), 'merge': ('.obj',), 'rotate': ('.glb',)}
+
+
+def count_faces(file_path: str) -> int:
+    """
+    Number of faces of an OBJ/GLB file without decoding it: `f` lines of an
+    OBJ, index (or position) accessor counts of the GLB JSON chunk.
+    """
+    if file_path.lower().endswith('.obj'):
+        faces = 0
+        with open(file_path, 'rb') as f:
+            for line in f:
+                faces += line.startswith(b'f ')
+        return faces
+    with open(file_path, 'rb') as f:
+        # 12 byte header, then the JSON chunk (length, type, data)
+        f.seek(12)
+        length, _ = struct.unpack('<II', f.read(8))
+        gltf = json.loads(f.read(length))
+    accessors = gltf.get('accessors', [])
+    return sum(
+        accessors[primitive['indices'] if 'indices' in primitive else primitive['attributes']['POSITION']]['count'] // 3
+        for mesh in gltf.get('meshes', [])
+        for primitive in mesh.get('primitives', [])
+    )
+
+
+def collect_files(inputs: list, command: str) -> list:
+    """
+    Files of `command`'s types in the given files, directories (recursive) and
+    glob patterns, without the `*_rotated.glb` outputs when rotating.
+    """
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*')
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if not os.path.isfile(path) or not path.lower().endswith(BATCH_EXTENSIONS[command]):
+                continue
+            # Outputs of earlier rotations are not rotated again
+            if command == 'rotate' and path.lower().endswith('_rotated.glb'):
+                continue
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def _process_file(command: str, file_path: str, output_dir: str, cache_dir: str = None):
+    """Run one batch job, returning (file_path, faces, error) instead of raising."""
+    try:
+        faces = count_faces(file_path)
+        if command == 'extract':
+            extract_submeshes(file_path, cache_dir=cache_dir, output_dir=output_dir, verbose=False)
+        elif command == 'merge':
+            merge_submeshes(file_path, output_dir=output_dir, verbose=False)
+        else:
+            glb_asset_rotator(file_path, cache_dir=cache_dir, output_dir=output_dir)
+        return file_path, faces, None
+    except Exception as e:
+        return file_path, 0, f"{type(e).__name__}: {e}"
+
+
+def process_assets(command: str,
+                   inputs: list,
+                   output_dir: str = "assets/processed",
+                   num_workers: int = None,
+                   cache_dir: str = None) -> dict:
+    """
+    Run `extract`, `merge` or `rotate` over many assets with a process pool.
+
+    Every file gets its own output folder `<output_dir>/<path relative to the
+    inputs' common folder>/` (extension kept, so `soda_can.obj` and
+    `soda_can.glb` do not share one), so that jobs never write same-named
+    submeshes into the same place. A failing file is reported and
+    skipped, the rest of the batch continues.
+
+    Parameters:
+        command: 'extract', 'merge' or 'rotate'.
+        inputs: Files, directories (searched recursively) or glob patterns.
+        output_dir: Root of the per-file output folders.
+        num_workers: Number of worker processes, all CPUs if None, 1 runs in this process.
+        cache_dir: Mesh cache folder used to load GLB files (see `load_scene`).
+
+    Returns:
+        failures: Dict mapping each failed file to its error message.
+    """
+    files = collect_files(inputs, command)
+    if len(files) == 0:
+        print(f"No {'/'.join(BATCH_EXTENSIONS[command])} files found in {inputs}")
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+    jobs = [
+        (command, f, os.path.join(output_dir, os.path.relpath(os.path.abspath(f), root)), cache_dir)
+        for f in files
+    ]
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    failures, total_faces = {}, 0
+    start = time.perf_counter()
+
+    def log(result):
+        nonlocal total_faces
+        file_path, faces, error = result
+        total_faces += faces
+        if error is not None:
+            tqdm.write(f"{file_path}: FAILED ({error})")
+            failures[file_path] = error
+
+    if num_workers <= 1:
+        for job in tqdm(jobs, desc=f"{command.capitalize()} assets"):
+            log(_process_file(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(_process_file, *job) for job in jobs]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=f"{command.capitalize()} assets"):
+                log(future.result())
+
+    elapsed = time.perf_counter() - start
+    done = len(files) - len(failures)
+    print(f"{command}: {done}/{len(files)} files, {total_faces} faces in {elapsed:.1f}s "
+          f"({done / elapsed:.2f} files/s, {total_faces / elapsed:.0f} faces/s) -> {output_dir}")
+    return failures
 
-if __name__ == "__main__":
-    # You can pass .obj or .glb file paths as needed
-    # extract_submeshes("assets/Bottle.obj")
-    # For glb files, you can call the split or merge submesh functions separately
-    # extract_submeshes("assets/Tin.glb")
-    # merge_submeshes("assets/soda_can.obj")
-    glb_asset_rotator("assets/Tree.glb")
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+from utils.render_utils import backproject, load_cameras, load_buffers, project_points
+from utils.label_utils import LabelStore
+
+
+def _find(parent: np.ndarray, i: int) -> int:
+    """Root of `i` in the union-find forest `parent` (with path halving)."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def fuse_parts(
+        asset_path: str,
+        data_list: list,
+        min_overlap: float = 0.5,
+        min_support: int = 20,
+        depth_tolerance: float = 0.005,
+        views_per_part: int = 1,
+        stride: int = 2,
+    ):
+    """
+    Link the part labels of all views of an asset into global parts.
+
+    Every labelled pixel is lifted to the world with its view's depth buffer
+    and camera, then projected into every other view; where it lands on the
+    same surface (depth within `depth_tolerance`, relative) the two labels
+    see each other. Two parts are linked when at least `min_overlap` of the
+    visible points of each fall onto the other (and at least `min_support`
+    points do), and linked parts are merged with union-find into global
+    parts. The `views_per_part` views in which a global part covers the
+    most pixels are selected as its VLM inputs (see `save_gpt_input`).
+
+    Parameters:
+        asset_path: Rendered asset folder with `cameras.npz`, `buffers/` and the label maps in `seg/`.
+        data_list: Image names of the views (e.g. 'render_0.png').
+        min_overlap: Minimal fraction of visible points in both directions to link two parts.
+        min_support: Minimal number of corresponding points to link two parts.
+        depth_tolerance: Relative depth difference under which two points are the same surface.
+        views_per_part: Number of views selected for every global part.
+        stride: Pixel stride of the lifted points.
+
+    Returns:
+        Dict written to `<asset_path>/parts.json`, None if the depth buffers were not rendered.
+    """
+    view_names = [data_path.split('.')[0] for data_path in data_list]
+    if not all(os.path.exists(os.path.join(asset_path, 'buffers', name + '.npz')) for name in view_names):
+        return None
+    cameras = load_cameras(asset_path)
+    # View i of the camera rig is images/render_i.png
+    camera_index = [int(name.split('_')[-1]) for name in view_names]
+    transforms, Ks = cameras['transforms'][camera_index], cameras['Ks'][camera_index]
+    depths = [load_buffers(asset_path, name)['depth'] for name in view_names]
+    with LabelStore(os.path.join(asset_path, 'seg')) as label_store:
+        seg_maps = [label_store[name] for name in view_names]
+
+    # One node per (view, label), labels >= 0 are parts
+    labels = [np.unique(seg_map[seg_map >= 0]) for seg_map in seg_maps]
+    offsets = np.concatenate([[0], np.cumsum([len(l) for l in labels])])
+    num_nodes = offsets[-1]
+    areas = np.concatenate([
+        np.bincount(np.searchsorted(l, seg_map[seg_map >= 0]), minlength=len(l)) for l, seg_map in zip(labels, seg_maps)
+    ]) if num_nodes > 0 else np.zeros(0, dtype=np.int64)
+
+    counts = np.zeros((num_nodes, num_nodes), dtype=np.int64)
+    visible = np.zeros((num_nodes, len(view_names)), dtype=np.int64)
+    height, width = seg_maps[0].shape
+    for v in range(len(view_names)):
+        points, ys, xs = backproject(np.where(seg_maps[v] >= 0, depths[v], 0), transforms[v], Ks[v], stride)
+        if len(points) == 0:
+            continue
+        source = offsets[v] + np.searchsorted(labels[v], seg_maps[v][ys, xs])
+        for w in range(len(view_names)):
+            if w == v:
+                continue
+            uv, depth = project_points(points, transforms[w:w + 1], Ks[w])
+            px, py = np.floor(uv[0, :, 0]).astype(np.int64), np.floor(uv[0, :, 1]).astype(np.int64)
+            inside = (depth[0] > 0) & (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            px, py = np.where(inside, px, 0), np.where(inside, py, 0)
+            target_depth = depths[w][py, px]
+            # Same surface seen from view w (not occluded, not background)
+            seen = inside & (target_depth > 0) & (np.abs(depth[0] - target_depth) <= depth_tolerance * target_depth)
+            seen &= seg_maps[w][py, px] >= 0
+            target = offsets[w] + np.searchsorted(labels[w], seg_maps[w][py[seen], px[seen]])
+            np.add.at(counts, (source[seen], target), 1)
+            # Points of every source part that are visible on any part of view w
+            np.add.at(visible, (source[seen], w), 1)
+
+    # Fraction of the points of part i visible in the view of part j that land on j
+    view_of = np.repeat(np.arange(len(view_names)), np.diff(offsets))
+    visible_in_view = visible[:, view_of]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap = np.where(visible_in_view > 0, counts / visible_in_view, 0)
+    linked = (overlap >= min_overlap) & (overlap.T >= min_overlap) & (np.minimum(counts, counts.T) >= min_support)
+
+    parent = np.arange(num_nodes)
+    for i, j in zip(*np.nonzero(np.triu(linked, 1))):
+        root_i, root_j = _find(parent, i), _find(parent, j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.array([_find(parent, i) for i in range(num_nodes)], dtype=np.int64)
+
+    parts = []
+    for root in np.unique(roots):
+        members = np.nonzero(roots == root)[0]
+        members = members[np.argsort(-areas[members], kind='stable')]
+        parts.append({
+            'id': len(parts),
+            'members': [[view_names[view_of[m]], int(labels[view_of[m]][m - offsets[view_of[m]]]), int(areas[m])] for m in members],
+            'selected': [[view_names[view_of[m]], int(labels[view_of[m]][m - offsets[view_of[m]]])] for m in members[:views_per_part]],
+        })
+    fusion = {'views': view_names, 'parts': parts}
+    with open(os.path.join(asset_path, 'parts.json'), 'w') as f:
+        json.dump(fusion, f, indent=1)
+    return fusion
+
+
+def load_selected_parts(asset_path: str):
+    """Set of the selected (view name, label) pairs of `parts.json`, None if the views were not fused."""
+    parts_file = os.path.join(asset_path, 'parts.json')
+    if not os.path.exists(parts_file):
+        return None
+    with open(parts_file) as f:
+        fusion = json.load(f)
+    return {(view, label) for part in fusion['parts'] for view, label in part['selected']}
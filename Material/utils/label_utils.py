@@ -0,0 +1,81 @@
+import os
+import numpy as np
+
+
+LABEL_STORE = 'labels.npz'
+
+
+def label_dtype(max_label: int):
+    """Smallest unsigned dtype holding the labels shifted by one (background -1 becomes 0)."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_label + 1 <= np.iinfo(dtype).max:
+            return dtype
+    raise ValueError(f"Label {max_label} does not fit in 32 bits")
+
+
+def save_labels(seg_folder: str, seg_maps: dict) -> str:
+    """
+    Pack the label maps of all views of an asset into `<seg_folder>/labels.npz`.
+
+    Every map is stored shifted by one in the smallest unsigned dtype that
+    holds its labels and deflate-compressed, one archive member per view, so
+    the mostly-background maps take a few KB instead of an int32 `.npy` each.
+    The archive is written next to its final name and renamed.
+
+    Parameters:
+        seg_folder: The asset's `seg` folder.
+        seg_maps: View name (e.g. 'render_0') -> (H, W) int label map, -1 is background.
+
+    Returns:
+        Path of the label store.
+    """
+    arrays = {}
+    for view_name, seg_map in seg_maps.items():
+        seg_map = np.asarray(seg_map)
+        arrays[view_name] = (seg_map + 1).astype(label_dtype(int(seg_map.max(initial=-1))))
+    path = os.path.join(seg_folder, LABEL_STORE)
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+class LabelStore:
+    """
+    Lazy reader of the label maps of one asset.
+
+    Reads the packed `labels.npz` written by `save_labels`, where a view is
+    only decompressed when it is accessed, and falls back to the legacy
+    per-view `<view>_s.npy` files of older runs. Maps are returned as int32
+    with -1 for the background.
+    """
+    def __init__(self, seg_folder: str):
+        self.seg_folder = seg_folder
+        path = os.path.join(seg_folder, LABEL_STORE)
+        self.archive = np.load(path) if os.path.exists(path) else None
+
+    @property
+    def views(self) -> list:
+        if self.archive is not None:
+            return list(self.archive.files)
+        return sorted(name[:-len('_s.npy')] for name in os.listdir(self.seg_folder) if name.endswith('_s.npy'))
+
+    def __contains__(self, view_name: str) -> bool:
+        return view_name in self.views
+
+    def __getitem__(self, view_name: str) -> np.ndarray:
+        if self.archive is None:
+            return np.load(os.path.join(self.seg_folder, view_name + '_s.npy'))
+        if view_name not in self.archive.files:
+            raise KeyError(view_name)
+        return self.archive[view_name].astype(np.int32) - 1
+
+    def close(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,218 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import trimesh
+from PIL import Image
+
+
+class MeshCache:
+    """
+    On-disk cache of decoded meshes keyed by the content hash of the source
+    file, so that a GLB is decoded (geometry and textures) once per asset
+    instead of once per stage.
+
+    Each entry `<cache_dir>/<key>/` holds uncompressed `.npy` arrays, which
+    are memory-mapped on load:
+        vertices, vertex_normals, uv (V, 2), colors (V, 4) and faces of all
+        geometries concatenated, `offsets` (G + 1, 2) the vertex/face offset
+        of every geometry, `transforms` (N, 4, 4) the world transform of every
+        node, and `textures/<i>.npy` the decoded RGBA/RGB texture images.
+    `meta.json` names the geometries and nodes and keeps the material
+    parameters together with references into `textures/`.
+
+    Entries are written to a temporary folder and renamed, so concurrent
+    workers never observe a partial entry.
+    """
+    version = 2
+    pbr_factors = ['baseColorFactor', 'metallicFactor', 'roughnessFactor', 'emissiveFactor', 'alphaMode', 'alphaCutoff', 'doubleSided']
+    pbr_textures = ['baseColorTexture', 'metallicRoughnessTexture', 'normalTexture', 'emissiveTexture', 'occlusionTexture']
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def key(cls, mesh_path: str) -> str:
+        """Hash the bytes of the mesh file (and the cache format version)."""
+        digest = hashlib.sha256(f"mesh-v{cls.version}".encode())
+        with open(mesh_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def store(self, key: str, scene: trimesh.Scene) -> bool:
+        """Add `scene` under `key`; scenes with non-triangle geometry are not cached (returns False)."""
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return True
+        if not all(isinstance(geometry, trimesh.Trimesh) for geometry in scene.geometry.values()):
+            return False
+
+        tmp_entry = f"{entry}.tmp-{os.getpid()}"
+        os.makedirs(os.path.join(tmp_entry, 'textures'), exist_ok=True)
+        names = list(scene.geometry.keys())
+        geometries, textures = [], {}
+
+        def texture_ref(image):
+            # Decode every (shared) image once and reference it by index
+            if image is None:
+                return None
+            if id(image) not in textures:
+                textures[id(image)] = f"textures/{len(textures)}.npy"
+                pixels = image
+                if pixels.mode not in ('RGB', 'RGBA', 'L'):
+                    # Palette ('P') and other modes would be stored as raw indices
+                    pixels = pixels.convert('RGBA' if 'A' in pixels.getbands() or 'transparency' in pixels.info else 'RGB')
+                np.save(os.path.join(tmp_entry, textures[id(image)]), np.asarray(pixels))
+            return textures[id(image)]
+
+        for name in names:
+            geometry = scene.geometry[name]
+            visual = geometry.visual
+            meta = {'name': name, 'kind': visual.kind, 'uv': False}
+            if visual.kind == 'texture':
+                material = visual.material
+                meta['uv'] = visual.uv is not None
+                if isinstance(material, trimesh.visual.material.PBRMaterial):
+                    meta['material'] = {
+                        'type': 'pbr',
+                        'name': material.name,
+                        **{field: _jsonable(getattr(material, field)) for field in self.pbr_factors},
+                        **{field: texture_ref(getattr(material, field)) for field in self.pbr_textures},
+                    }
+                else:
+                    meta['material'] = {
+                        'type': 'simple',
+                        'name': getattr(material, 'name', None),
+                        'main_color': _jsonable(material.main_color),
+                        'image': texture_ref(getattr(material, 'image', None)),
+                    }
+            geometries.append(meta)
+
+        counts = np.array([[len(g.vertices), len(g.faces)] for g in scene.geometry.values()], dtype=np.int64).reshape(-1, 2)
+        offsets = np.concatenate([np.zeros((1, 2), dtype=np.int64), np.cumsum(counts, axis=0)])
+        arrays = {
+            'vertices': [g.vertices for g in scene.geometry.values()],
+            'vertex_normals': [g.vertex_normals for g in scene.geometry.values()],
+            'faces': [g.faces for g in scene.geometry.values()],
+            'uv': [
+                g.visual.uv if meta['uv'] else np.zeros((len(g.vertices), 2))
+                for g, meta in zip(scene.geometry.values(), geometries)
+            ],
+            'colors': [
+                g.visual.vertex_colors if g.visual.kind != 'texture' else np.zeros((len(g.vertices), 4), dtype=np.uint8)
+                for g in scene.geometry.values()
+            ],
+        }
+        for field, parts in arrays.items():
+            np.save(os.path.join(tmp_entry, f'{field}.npy'), np.concatenate([np.asarray(p) for p in parts]) if parts else np.zeros((0, 3)))
+        np.save(os.path.join(tmp_entry, 'offsets.npy'), offsets)
+
+        nodes = list(scene.graph.nodes_geometry)
+        transforms = np.array([scene.graph[node][0] for node in nodes], dtype=np.float64).reshape(-1, 4, 4)
+        np.save(os.path.join(tmp_entry, 'transforms.npy'), transforms)
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+            json.dump({
+                'geometries': geometries,
+                'nodes': [{'name': node, 'geometry': names.index(scene.graph[node][1])} for node in nodes],
+            }, f)
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        return True
+
+    def load(self, key: str, mmap: bool = True):
+        """Rebuild the cached scene of `key` (arrays memory-mapped if `mmap`), None on a miss."""
+        entry = self.entry(key)
+        if not os.path.exists(os.path.join(entry, 'meta.json')):
+            return None
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {
+            field: np.load(os.path.join(entry, f'{field}.npy'), mmap_mode=mmap_mode)
+            for field in ['vertices', 'vertex_normals', 'faces', 'uv', 'colors', 'offsets', 'transforms']
+        }
+        images = {}
+
+        def image(ref):
+            if ref is None:
+                return None
+            if ref not in images:
+                images[ref] = Image.fromarray(np.load(os.path.join(entry, ref)))
+            return images[ref]
+
+        scene = trimesh.Scene()
+        for index, geometry in enumerate(meta['geometries']):
+            (v0, f0), (v1, f1) = arrays['offsets'][index], arrays['offsets'][index + 1]
+            if geometry['kind'] == 'texture':
+                material = dict(geometry['material'])
+                if material.pop('type') == 'pbr':
+                    for field in self.pbr_textures:
+                        material[field] = image(material[field])
+                    material = trimesh.visual.material.PBRMaterial(**material)
+                else:
+                    material = trimesh.visual.material.SimpleMaterial(
+                        name=material['name'],
+                        image=image(material['image']),
+                        diffuse=material['main_color'],
+                    )
+                visual = trimesh.visual.TextureVisuals(
+                    uv=arrays['uv'][v0:v1] if geometry['uv'] else None,
+                    material=material,
+                )
+            else:
+                visual = trimesh.visual.ColorVisuals(vertex_colors=arrays['colors'][v0:v1])
+            scene.geometry[geometry['name']] = trimesh.Trimesh(
+                vertices=arrays['vertices'][v0:v1],
+                faces=arrays['faces'][f0:f1],
+                vertex_normals=arrays['vertex_normals'][v0:v1],
+                visual=visual,
+                process=False,
+            )
+        for node, transform in zip(meta['nodes'], arrays['transforms']):
+            scene.graph.update(
+                frame_to=node['name'],
+                frame_from=scene.graph.base_frame,
+                matrix=np.array(transform),
+                geometry=meta['geometries'][node['geometry']]['name'],
+            )
+        return scene
+
+
+def _jsonable(value):
+    """Material parameters as JSON values (arrays become lists)."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def load_scene(mesh_path: str, cache_dir: str = None) -> trimesh.Scene:
+    """
+    Load `mesh_path` as a `trimesh.Scene`, through the mesh cache if `cache_dir` is set.
+
+    On a miss the file is decoded with `trimesh.load` and stored, later calls
+    (from any stage or process) rebuild the scene from the memory-mapped
+    arrays without decoding the file or its textures again.
+    """
+    if cache_dir is None:
+        return trimesh.load(mesh_path, force='scene')
+    cache = MeshCache(cache_dir)
+    key = cache.key(mesh_path)
+    scene = cache.load(key)
+    if scene is None:
+        scene = trimesh.load(mesh_path, force='scene')
+        if cache.store(key, scene):
+            # Hand out the cached form on a miss too, so every stage sees the same scene
+            scene = cache.load(key)
+    return scene
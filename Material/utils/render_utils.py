@@ -0,0 +1,963 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from trimesh.transformations import transform_points
+
+
+class Renderer:
+    """
+    Common interface of the render backends: `load` a scene once, then
+    `render` any number of camera poses into (H, W, 4) uint8 RGBA images.
+    After `load`, `K` holds the (3, 3) intrinsics the backend projects with.
+    """
+    backend = None
+
+    def __init__(self, resolution: tuple = (800, 600)):
+        self.resolution = tuple(int(r) for r in resolution)
+        self.timings = []
+
+    def load(self, scene) -> None:
+        raise NotImplementedError
+
+    def render(self, camera_transform: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def render_passes(self, camera_transform: np.ndarray) -> dict:
+        """
+        Render RGBA together with the auxiliary buffers of the same view.
+
+        Returns:
+            Dict with `rgba` (H, W, 4) uint8, `depth` (H, W) float32 distance
+            along the view axis (0 on the background), `normal` (H, W, 3)
+            float32 world-space normals and `instance` (H, W) int32 index into
+            `instance_names` (-1 on the background).
+        """
+        raise NotImplementedError
+
+    @property
+    def instance_names(self) -> list:
+        """`scene.geometry` key of every instance id in the `instance` buffer."""
+        raise NotImplementedError
+
+    def report(self, reset: bool = True) -> str:
+        """Summarise setup and per-view render times recorded so far."""
+        setup = [t['seconds'] for t in self.timings if t['stage'] == 'setup']
+        views = [t['seconds'] for t in self.timings if t['stage'] == 'view']
+        if reset:
+            self.timings = []
+        if len(views) == 0:
+            return "No views rendered"
+        return (
+            f"{len(views)} views | setup {1000 * sum(setup):.1f} ms over {len(setup)} loads | "
+            f"per view {1000 * np.mean(views):.1f} ms (min {1000 * np.min(views):.1f}, max {1000 * np.max(views):.1f})"
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class GLRenderer(Renderer):
+    """
+    Offscreen OpenGL renderer that keeps a single hidden pyglet window
+    (and its GL context) alive across views and assets.
+
+    `trimesh.Scene.save_image` creates and destroys a window plus GL
+    context for every call; here the context is created once, each asset's
+    geometry is uploaded once with `load`, and every camera pose is drawn
+    into the same framebuffer with `render`.
+
+    Reusing the viewer goes through private `SceneViewer` internals, so
+    trimesh is pinned in requirements.txt; `__init__` fails early if the
+    installed release lacks them.
+    """
+    backend = 'gl'
+    viewer_internals = ('_update_vertex_list', '_update_perspective', '_redraw', 'init_gl', 'reset_view')
+
+    def __init__(self, resolution: tuple = (800, 600)):
+        super().__init__(resolution)
+        # pyglet is only needed (and only imported) for this backend
+        os.environ.setdefault('DISPLAY', ':1')
+        import pyglet
+        pyglet.options['headless'] = True
+        from pyglet import gl
+        import trimesh
+        from trimesh.viewer.windowed import SceneViewer
+
+        missing = [name for name in self.viewer_internals if not hasattr(SceneViewer, name)]
+        if len(missing) > 0:
+            raise ImportError(
+                f"trimesh {trimesh.__version__} SceneViewer lacks {missing}, "
+                "install the trimesh release pinned in requirements.txt"
+            )
+
+        self.pyglet = pyglet
+        self.window_conf = gl.Config(double_buffer=True, depth_size=24)
+        self.viewer = None
+        # Flat-coloured face id geometry of the auxiliary passes, built on first use per asset,
+        # drawn into its own RGBA8 framebuffer (the window's may have fewer colour bits)
+        self._id_pass = None
+        self._id_framebuffer = None
+
+    def load(self, scene) -> None:
+        """Upload the geometry of `scene` to the GL context."""
+        from trimesh.viewer.windowed import SceneViewer
+        from trimesh.transformations import translation_matrix
+
+        start = time.perf_counter()
+        scene.camera.resolution = self.resolution
+        self._release_id_pass()
+        if self.viewer is None:
+            self.viewer = SceneViewer(
+                scene,
+                start_loop=False,
+                visible=False,
+                resolution=self.resolution,
+                resizable=False,
+                window_conf=self.window_conf,
+            )
+        else:
+            viewer = self.viewer
+            viewer.switch_to()
+            # Drop the previous asset's vertex lists and textures
+            for vertex_list in viewer.vertex_list.values():
+                vertex_list.delete()
+            viewer.vertex_list.clear()
+            viewer.vertex_list_hash.clear()
+            viewer.vertex_list_mode.clear()
+            viewer.textures.clear()
+
+            viewer.scene = viewer._scene = scene
+            scene._redraw = viewer._redraw
+            viewer._initial_camera_transform = scene.camera_transform.copy()
+            viewer._line_offset = translation_matrix(
+                [0, 0, scene.scale / 1000 if viewer.offset_lines else 0]
+            )
+            viewer.reset_view()
+            viewer._update_vertex_list()
+            # Light positions are transformed by the current modelview matrix,
+            # which still holds the last view: reset it as in a fresh context
+            gl = self.pyglet.gl
+            gl.glMatrixMode(gl.GL_MODELVIEW)
+            gl.glLoadIdentity()
+            viewer.init_gl()
+            viewer._update_perspective(*self.resolution)
+
+        # The first frames after a (re)load are not guaranteed to be drawn
+        for _ in range(2):
+            self._draw()
+        self.timings.append({'stage': 'setup', 'seconds': time.perf_counter() - start})
+
+    def _draw(self) -> None:
+        viewer = self.viewer
+        camera_transform = viewer.scene.camera_transform.copy()
+        self.pyglet.clock.tick()
+        viewer.switch_to()
+        viewer.dispatch_events()
+        # Window events may reset the camera to the trackball pose
+        viewer.scene.camera_transform = camera_transform
+        viewer.dispatch_event('on_draw')
+        viewer.flip()
+
+    def render(self, camera_transform: np.ndarray) -> np.ndarray:
+        """
+        Render the loaded scene from `camera_transform`.
+
+        Returns:
+            rgba: (H, W, 4) uint8 image.
+        """
+        assert self.viewer is not None, "Call `load` before `render`"
+        start = time.perf_counter()
+        self.viewer.scene.camera_transform = camera_transform
+        self._draw()
+
+        colorbuffer = self.pyglet.image.get_buffer_manager().get_color_buffer()
+        image_data = colorbuffer.get_image_data()
+        width, height = image_data.width, image_data.height
+        rgba = np.frombuffer(image_data.get_data('RGBA', width * 4), dtype=np.uint8)
+        rgba = rgba.reshape(height, width, 4)[::-1].copy()
+
+        self.timings.append({'stage': 'view', 'seconds': time.perf_counter() - start})
+        return rgba
+
+    def _build_id_pass(self) -> None:
+        """
+        Upload every node once more as unindexed triangles coloured with
+        their (24 bit) face id + 1, and keep the world-space corners and
+        normals of the faces to interpolate the normals of the id pass.
+        """
+        import trimesh
+
+        scene = self.viewer.scene
+        nodes, names, corners, normals, face_instance = [], [], [], [], []
+        count = 0
+        for node in scene.graph.nodes_geometry:
+            transform, geometry_name = scene.graph[node]
+            geometry = scene.geometry[geometry_name]
+            if not isinstance(geometry, trimesh.Trimesh) or geometry.is_empty:
+                continue
+            faces = np.asarray(geometry.faces)
+            ids = np.arange(count + 1, count + 1 + len(faces), dtype=np.uint32)
+            colors = np.stack([ids & 0xFF, (ids >> 8) & 0xFF, (ids >> 16) & 0xFF], axis=1).astype(np.uint8)
+            vertices = np.asarray(geometry.vertices, dtype=np.float32)[faces].reshape(-1)
+            vertex_list = self.pyglet.graphics.vertex_list(
+                3 * len(faces),
+                ('v3f/static', vertices),
+                ('c3B/static', np.repeat(colors, 3, axis=0).reshape(-1)),
+            )
+            nodes.append((transform, vertex_list))
+            corners.append(transform_points(geometry.vertices, transform)[faces])
+            normals.append((np.asarray(geometry.vertex_normals) @ transform[:3, :3].T)[faces])
+            face_instance.append(np.full(len(faces), len(names), dtype=np.int32))
+            names.append(geometry_name)
+            count += len(faces)
+        if count >= 2 ** 24:
+            raise ValueError(f"{count} faces do not fit in the 24 bit face ids of the GL id pass")
+        normals = np.concatenate(normals) if count > 0 else np.zeros((0, 3, 3))
+        self._id_pass = {
+            'nodes': nodes,
+            'names': names,
+            'corners': np.concatenate(corners) if count > 0 else np.zeros((0, 3, 3)),
+            'normals': normals / np.maximum(np.linalg.norm(normals, axis=2, keepdims=True), 1e-12),
+            'face_instance': np.concatenate(face_instance) if count > 0 else np.zeros(0, dtype=np.int32),
+        }
+
+    def _bind_id_framebuffer(self) -> None:
+        """Bind the offscreen RGBA8 + 24 bit depth framebuffer of the id pass (created once)."""
+        gl = self.pyglet.gl
+        if self._id_framebuffer is None:
+            width, height = self.resolution
+            framebuffer, renderbuffers = gl.GLuint(), (gl.GLuint * 2)()
+            gl.glGenFramebuffers(1, framebuffer)
+            gl.glGenRenderbuffers(2, renderbuffers)
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+            for renderbuffer, storage, attachment in zip(
+                    renderbuffers,
+                    (gl.GL_RGBA8, gl.GL_DEPTH_COMPONENT24),
+                    (gl.GL_COLOR_ATTACHMENT0, gl.GL_DEPTH_ATTACHMENT),
+                ):
+                gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, renderbuffer)
+                gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, storage, width, height)
+                gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, attachment, gl.GL_RENDERBUFFER, renderbuffer)
+            status = gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER)
+            if status != gl.GL_FRAMEBUFFER_COMPLETE:
+                gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+                raise RuntimeError(f"Incomplete GL framebuffer for the id pass (status {status:#x})")
+            self._id_framebuffer = (framebuffer, renderbuffers)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self._id_framebuffer[0])
+
+    def _release_id_pass(self) -> None:
+        if self._id_pass is not None:
+            for _, vertex_list in self._id_pass['nodes']:
+                vertex_list.delete()
+            self._id_pass = None
+
+    def render_passes(self, camera_transform: np.ndarray) -> dict:
+        """
+        Render RGBA with GL, then draw the face ids flat-coloured (no
+        lighting, textures or blending) in the same context and read back
+        its colour and depth buffers. The depth is linearised from the GL
+        depth buffer, the instance comes from the face id and the normal is
+        interpolated over the face at the pixel's depth, so all buffers
+        come from the GL rasterizer that drew the RGBA.
+        """
+        from trimesh.rendering import matrix_to_gl
+
+        start = time.perf_counter()
+        rgba = self.render(camera_transform)
+        # Timed as one view together with the id pass
+        self.timings.pop()
+        if self._id_pass is None:
+            self._build_id_pass()
+        gl = self.pyglet.gl
+        width, height = self.resolution
+
+        self.viewer.switch_to()
+        self._bind_id_framebuffer()
+        gl.glPushAttrib(gl.GL_ENABLE_BIT | gl.GL_COLOR_BUFFER_BIT | gl.GL_LIGHTING_BIT)
+        for capability in (gl.GL_LIGHTING, gl.GL_TEXTURE_2D, gl.GL_BLEND, gl.GL_DITHER):
+            gl.glDisable(capability)
+        gl.glShadeModel(gl.GL_FLAT)
+        gl.glClearColor(0, 0, 0, 0)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
+        gl.glMultMatrixf(matrix_to_gl(np.linalg.inv(camera_transform)))
+        for transform, vertex_list in self._id_pass['nodes']:
+            gl.glPushMatrix()
+            gl.glMultMatrixf(matrix_to_gl(transform))
+            vertex_list.draw(gl.GL_TRIANGLES)
+            gl.glPopMatrix()
+        colors = (gl.GLubyte * (width * height * 4))()
+        gl.glReadPixels(0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, colors)
+        depths = (gl.GLfloat * (width * height))()
+        gl.glReadPixels(0, 0, width, height, gl.GL_DEPTH_COMPONENT, gl.GL_FLOAT, depths)
+        gl.glPopAttrib()
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+        # GL rows start at the bottom
+        colors = np.frombuffer(colors, dtype=np.uint8).reshape(height, width, 4)[::-1].astype(np.int64)
+        window_depth = np.frombuffer(depths, dtype=np.float32).reshape(height, width)[::-1]
+        face_id = colors[..., 0] + (colors[..., 1] << 8) + (colors[..., 2] << 16) - 1
+
+        camera = self.viewer.scene.camera
+        near, far = camera.z_near, camera.z_far
+        # Inverse of the gluPerspective depth mapping
+        ndc = 2.0 * window_depth.astype(np.float64) - 1.0
+        depth = np.where(face_id >= 0, 2.0 * near * far / (far + near - ndc * (far - near)), 0).astype(np.float32)
+
+        hit = face_id >= 0
+        faces = face_id[hit]
+        points, _, _ = backproject(depth, camera_transform, self.K, stride=1)
+        weights = _barycentric(points, self._id_pass['corners'][faces])
+        normal = (self._id_pass['normals'][faces] * weights[:, :, None]).sum(axis=1)
+        normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-12)
+
+        passes = {
+            'rgba': rgba,
+            'depth': depth,
+            'normal': np.zeros((height, width, 3), dtype=np.float32),
+            'instance': np.full((height, width), -1, dtype=np.int32),
+        }
+        passes['normal'][hit] = normal
+        passes['instance'][hit] = self._id_pass['face_instance'][faces]
+        self.timings.append({'stage': 'view', 'seconds': time.perf_counter() - start})
+        return passes
+
+    @property
+    def instance_names(self) -> list:
+        return self._id_pass['names']
+
+    @property
+    def K(self) -> np.ndarray:
+        """
+        Intrinsics of the GL projection: `gluPerspective` keeps the vertical
+        field of view of `scene.camera` with square pixels, so the focal
+        lengths are equal (unlike `scene.camera.K`, built from both angles).
+        """
+        return gl_intrinsics(self.viewer.scene.camera.fov, self.resolution)
+
+    def close(self) -> None:
+        if self.viewer is not None:
+            self.viewer.switch_to()
+        self._release_id_pass()
+        if self._id_framebuffer is not None:
+            gl = self.pyglet.gl
+            framebuffer, renderbuffers = self._id_framebuffer
+            gl.glDeleteRenderbuffers(2, renderbuffers)
+            gl.glDeleteFramebuffers(1, framebuffer)
+            self._id_framebuffer = None
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+
+
+class SoftwareRenderer(Renderer):
+    """
+    Pure-NumPy CPU rasterizer with the same camera conventions as the GL
+    backend (`gl_intrinsics`, OpenGL camera looking down -Z). Needs no
+    display server or GL context, so any number of workers can run it.
+
+    Triangles are rasterized in chunks: every triangle is expanded to the
+    pixels of its screen bounding box, barycentric coordinates are computed
+    for all of them at once and the nearest fragment per pixel wins the
+    z-buffer. Shading is deferred to the surviving fragments.
+    """
+    backend = 'software'
+    near = 1e-3
+    ambient = 0.35
+    background = np.array([255, 255, 255, 0], dtype=np.uint8)
+
+    def __init__(self, resolution: tuple = (800, 600), max_fragments: int = 2 ** 22):
+        super().__init__(resolution)
+        self.max_fragments = max_fragments
+        self.vertices = None
+
+    def load(self, scene) -> None:
+        """Flatten the scene graph into world-space arrays."""
+        import trimesh
+
+        start = time.perf_counter()
+        scene.camera.resolution = self.resolution
+        # Same projection as the GL backend, so both render pixel-aligned views
+        self.K = gl_intrinsics(scene.camera.fov, self.resolution)
+
+        vertices, normals, faces, face_instance = [], [], [], []
+        self.instances = []
+        offset = 0
+        for node in scene.graph.nodes_geometry:
+            transform, geometry_name = scene.graph[node]
+            geometry = scene.geometry[geometry_name]
+            if not isinstance(geometry, trimesh.Trimesh) or geometry.is_empty:
+                continue
+            vertices.append(transform_points(geometry.vertices, transform))
+            normals.append(geometry.vertex_normals @ transform[:3, :3].T)
+            faces.append(geometry.faces + offset)
+            face_instance.append(np.full(len(geometry.faces), len(self.instances)))
+            self.instances.append({
+                'name': geometry_name,
+                'offset': offset,
+                **self._shading(geometry),
+            })
+            offset += len(geometry.vertices)
+
+        if len(faces) == 0:
+            raise ValueError("Scene has no triangle geometry to render")
+        self.vertices = np.concatenate(vertices)
+        normals = np.concatenate(normals)
+        self.normals = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+        self.faces = np.concatenate(faces)
+        self.face_instance = np.concatenate(face_instance)
+        self.timings.append({'stage': 'setup', 'seconds': time.perf_counter() - start})
+
+    @staticmethod
+    def _shading(geometry) -> dict:
+        """Extract what is needed to colour a geometry: a texture or vertex colours."""
+        visual = geometry.visual
+        if visual.kind == 'texture':
+            material = getattr(visual, 'material', None)
+            image = getattr(material, 'baseColorTexture', None)
+            if image is None:
+                image = getattr(material, 'image', None)
+            if image is not None and visual.uv is not None:
+                return {
+                    'texture': np.asarray(image.convert('RGBA')),
+                    'uv': np.asarray(visual.uv, dtype=np.float64),
+                }
+            color = getattr(material, 'main_color', None)
+            if color is None:
+                color = [102, 102, 102, 255]
+            return {'colors': np.tile(np.asarray(color, dtype=np.uint8), (len(geometry.vertices), 1))}
+        return {'colors': np.asarray(visual.vertex_colors, dtype=np.uint8)}
+
+    def _project(self, camera_transform: np.ndarray):
+        """Image coordinates, view depth (per face corner) and signed image-space area of every face."""
+        fx, fy = self.K[0, 0], self.K[1, 1]
+        cx, cy = self.K[0, 2], self.K[1, 2]
+
+        # world -> camera (OpenGL: camera looks down -Z, Y up)
+        points = transform_points(self.vertices, np.linalg.inv(camera_transform))
+        depth = -points[:, 2]
+        safe = np.where(depth > self.near, depth, np.inf)
+        u = cx + fx * points[:, 0] / safe
+        v = cy - fy * points[:, 1] / safe
+
+        tri_u, tri_v, tri_d = u[self.faces], v[self.faces], depth[self.faces]
+        area = (tri_u[:, 1] - tri_u[:, 0]) * (tri_v[:, 2] - tri_v[:, 0]) \
+            - (tri_u[:, 2] - tri_u[:, 0]) * (tri_v[:, 1] - tri_v[:, 0])
+        return tri_u, tri_v, tri_d, area
+
+    def _rasterize(self, camera_transform: np.ndarray):
+        """
+        Rasterize all triangles from `camera_transform`.
+
+        Returns:
+            zbuffer: (H*W,) float distance along the view axis, inf where empty.
+            face_id: (H*W,) int face index, -1 where empty.
+            bary: (H*W, 3) perspective-correct barycentric coordinates.
+        """
+        width, height = self.resolution
+        tri_u, tri_v, tri_d, area = self._project(camera_transform)
+
+        # Pixel centres sit at half-integers; counter-clockwise faces in a
+        # y-up frame have negative area in image space, the rest are culled
+        x0 = np.clip(np.ceil(tri_u.min(axis=1) - 0.5), 0, width)
+        x1 = np.clip(np.floor(tri_u.max(axis=1) - 0.5), -1, width - 1)
+        y0 = np.clip(np.ceil(tri_v.min(axis=1) - 0.5), 0, height)
+        y1 = np.clip(np.floor(tri_v.max(axis=1) - 0.5), -1, height - 1)
+        valid = (tri_d.min(axis=1) > self.near) & (area < 0) & (x1 >= x0) & (y1 >= y0)
+
+        faces = np.nonzero(valid)[0]
+        x0, y0 = x0[faces].astype(np.int64), y0[faces].astype(np.int64)
+        box_w = x1[faces].astype(np.int64) - x0 + 1
+        box_h = y1[faces].astype(np.int64) - y0 + 1
+        counts = box_w * box_h
+
+        zbuffer = np.full(width * height, np.inf)
+        face_id = np.full(width * height, -1, dtype=np.int64)
+        bary = np.zeros((width * height, 3))
+
+        # Split faces into chunks of bounded fragment count
+        chunk_id = (np.cumsum(counts) - counts) // self.max_fragments
+        for chunk in np.split(np.arange(len(faces)), np.nonzero(np.diff(chunk_id))[0] + 1):
+            if len(chunk) == 0:
+                continue
+            n = counts[chunk]
+            local = np.repeat(np.arange(len(chunk)), n)
+            index = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            px = x0[chunk][local] + index % box_w[chunk][local]
+            py = y0[chunk][local] + index // box_w[chunk][local]
+
+            f = faces[chunk][local]
+            su, sv = px + 0.5 - tri_u[f, 0], py + 0.5 - tri_v[f, 0]
+            e1u, e1v = tri_u[f, 1] - tri_u[f, 0], tri_v[f, 1] - tri_v[f, 0]
+            e2u, e2v = tri_u[f, 2] - tri_u[f, 0], tri_v[f, 2] - tri_v[f, 0]
+            b1 = (su * e2v - e2u * sv) / area[f]
+            b2 = (e1u * sv - su * e1v) / area[f]
+            b0 = 1.0 - b1 - b2
+            inside = (b0 >= 0) & (b1 >= 0) & (b2 >= 0)
+            if not inside.any():
+                continue
+            f, px, py = f[inside], px[inside], py[inside]
+            b = np.stack([b0[inside], b1[inside], b2[inside]], axis=1)
+
+            # Perspective-correct interpolation of depth and barycentrics
+            b = b / tri_d[f]
+            inv_depth = b.sum(axis=1)
+            b /= inv_depth[:, None]
+            frag_depth = 1.0 / inv_depth
+
+            # Keep the nearest fragment per pixel, then test against the z-buffer
+            pixel = py * width + px
+            order = np.lexsort((frag_depth, pixel))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = pixel[order][1:] != pixel[order][:-1]
+            nearest = order[first]
+            closer = frag_depth[nearest] < zbuffer[pixel[nearest]]
+            nearest = nearest[closer]
+
+            zbuffer[pixel[nearest]] = frag_depth[nearest]
+            face_id[pixel[nearest]] = f[nearest]
+            bary[pixel[nearest]] = b[nearest]
+
+        return zbuffer, face_id, bary
+
+    def visible_faces(self, camera_transform: np.ndarray, tolerance: float = 0.01) -> np.ndarray:
+        """
+        Boolean mask of the faces visible from `camera_transform`.
+
+        A face is visible if it wins a pixel of the z-buffer, or if it is
+        front-facing and its centroid is within `tolerance` (relative depth)
+        of the z-buffer at the centroid's pixel. The second test keeps
+        faces smaller than a pixel from flickering in and out at low
+        resolution.
+        """
+        assert self.vertices is not None, "Call `load` before `visible_faces`"
+        width, height = self.resolution
+        zbuffer, face_id, _ = self._rasterize(camera_transform)
+        tri_u, tri_v, tri_d, area = self._project(camera_transform)
+
+        visible = np.zeros(len(self.faces), dtype=bool)
+        visible[face_id[face_id >= 0]] = True
+
+        px = np.floor(tri_u.mean(axis=1)).astype(np.int64)
+        py = np.floor(tri_v.mean(axis=1)).astype(np.int64)
+        front = (tri_d.min(axis=1) > self.near) & (area < 0) \
+            & (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        faces = np.nonzero(front)[0]
+        surface = zbuffer[py[faces] * width + px[faces]]
+        visible[faces[tri_d[faces].mean(axis=1) <= surface * (1.0 + tolerance)]] = True
+        return visible
+
+    def render(self, camera_transform: np.ndarray) -> np.ndarray:
+        """
+        Render the loaded scene from `camera_transform`.
+
+        Returns:
+            rgba: (H, W, 4) uint8 image, alpha is 0 on the background.
+        """
+        return self.render_passes(camera_transform)['rgba']
+
+    def render_passes(self, camera_transform: np.ndarray, shade: bool = True) -> dict:
+        """
+        Rasterize once and return RGBA (if `shade`) together with the depth,
+        normal and instance buffers of the same z-buffer pass.
+        """
+        assert self.vertices is not None, "Call `load` before `render`"
+        start = time.perf_counter()
+        width, height = self.resolution
+        zbuffer, face_id, bary = self._rasterize(camera_transform)
+
+        pixels = np.nonzero(face_id >= 0)[0]
+        faces = face_id[pixels]
+        corners = self.faces[faces]
+        weights = bary[pixels]
+        instance = self.face_instance[faces]
+
+        normal = (self.normals[corners] * weights[:, :, None]).sum(axis=1)
+        normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-12)
+
+        passes = {
+            'depth': np.zeros(width * height, dtype=np.float32),
+            'normal': np.zeros((width * height, 3), dtype=np.float32),
+            'instance': np.full(width * height, -1, dtype=np.int32),
+        }
+        passes['depth'][pixels] = zbuffer[pixels]
+        passes['normal'][pixels] = normal
+        passes['instance'][pixels] = instance
+
+        if shade:
+            color = np.zeros((len(pixels), 3))
+            for index, shading in enumerate(self.instances):
+                select = instance == index
+                if not select.any():
+                    continue
+                w = weights[select][:, :, None]
+                local = corners[select] - shading['offset']
+                if 'texture' in shading:
+                    texture = shading['texture']
+                    uv = (shading['uv'][local] * w).sum(axis=1) % 1.0
+                    tx = np.clip((uv[:, 0] * texture.shape[1]).astype(np.int64), 0, texture.shape[1] - 1)
+                    ty = np.clip(((1.0 - uv[:, 1]) * texture.shape[0]).astype(np.int64), 0, texture.shape[0] - 1)
+                    color[select] = texture[ty, tx, :3]
+                else:
+                    color[select] = (shading['colors'][local][:, :, :3] * w).sum(axis=1)
+
+            # Lambertian headlight so that shape stays readable for segmentation
+            lambert = np.abs(normal @ camera_transform[:3, 2])
+            color *= (self.ambient + (1.0 - self.ambient) * lambert)[:, None]
+
+            rgba = np.tile(self.background, (width * height, 1))
+            rgba[pixels, :3] = np.clip(color, 0, 255).astype(np.uint8)
+            rgba[pixels, 3] = 255
+            passes['rgba'] = rgba
+
+        passes = {key: value.reshape(height, width, *value.shape[1:]) for key, value in passes.items()}
+        self.timings.append({'stage': 'view', 'seconds': time.perf_counter() - start})
+        return passes
+
+    @property
+    def instance_names(self) -> list:
+        return [instance['name'] for instance in self.instances]
+
+
+def gl_intrinsics(fov: tuple, resolution: tuple) -> np.ndarray:
+    """
+    (3, 3) intrinsics of the `gluPerspective` projection the GL backend draws
+    with: the vertical field of view `fov[1]` (degrees) with square pixels.
+    """
+    width, height = resolution
+    focal = 0.5 * height / np.tan(np.radians(fov[1]) / 2.0)
+    return np.array([
+        [focal, 0.0, width / 2.0],
+        [0.0, focal, height / 2.0],
+        [0.0, 0.0, 1.0],
+    ])
+
+
+def create_renderer(backend: str = 'gl', resolution: tuple = (800, 600)) -> Renderer:
+    """Create a renderer for `backend`, either 'gl' (pyglet/OpenGL) or 'software' (NumPy)."""
+    if backend == 'gl':
+        return GLRenderer(resolution=resolution)
+    elif backend == 'software':
+        return SoftwareRenderer(resolution=resolution)
+    raise ValueError(f"Unknown render backend: {backend}")
+
+
+def camera_poses(
+        center: np.ndarray,
+        distance: float,
+        azimuth: np.ndarray,
+        elevation: np.ndarray,
+    ) -> np.ndarray:
+    """
+    Compute camera transforms for paired azimuth/elevation angles in one batch.
+
+    Equivalent to `trimesh.scene.cameras.look_at` with a fixed `center` and
+    `distance`, using the TRELLIS orientation (euler x = 90 - elevation,
+    euler z = 180 - azimuth), without touching the mesh vertices.
+
+    Parameters:
+        center: (3,) point the cameras look at.
+        distance: Camera distance from `center`.
+        azimuth: (N,) azimuth angles (in degrees).
+        elevation: (N,) elevation angles (in degrees).
+
+    Returns:
+        transforms: (N, 4, 4) camera-to-world transforms.
+    """
+    azimuth = np.asarray(azimuth, dtype=np.float64).ravel()
+    elevation = np.asarray(elevation, dtype=np.float64).ravel()
+    euler = np.stack([90 - elevation, np.zeros_like(azimuth), 180 - azimuth], axis=1)
+    rotation = R.from_euler('xyz', euler, degrees=True).as_matrix()
+
+    transforms = np.tile(np.eye(4), (len(azimuth), 1, 1))
+    transforms[:, :3, :3] = rotation
+    # The camera sits `distance` along its own +Z axis, looking back at the center
+    transforms[:, :3, 3] = np.asarray(center) + distance * rotation[:, :, 2]
+    return transforms
+
+
+def fibonacci_views(num_views: int) -> tuple:
+    """Azimuth/elevation angles (in degrees) of `num_views` near-uniform directions on the sphere."""
+    index = np.arange(num_views) + 0.5
+    elevation = np.degrees(np.arcsin(1.0 - 2.0 * index / num_views))
+    azimuth = np.degrees(index * np.pi * (3.0 - np.sqrt(5.0))) % 360.0
+    return azimuth, elevation
+
+
+def select_views(
+        scene,
+        center: np.ndarray,
+        distance: float,
+        azimuth: np.ndarray,
+        elevation: np.ndarray,
+        coverage_target: float = 0.95,
+        max_views: int = 9,
+        resolution: tuple = (160, 120),
+    ) -> np.ndarray:
+    """
+    Pick the fewest candidate views that together see `coverage_target` of
+    the visible surface area of `scene`.
+
+    Every candidate is rasterized once at low resolution with the software
+    backend to get its set of visible faces (`visible_faces`), then views are added greedily by
+    the area of the faces they see that are not covered yet. Coverage is
+    relative to the faces visible from at least one candidate, so interior
+    faces do not keep the planner adding views.
+
+    Parameters:
+        scene: trimesh.Scene to plan for (already rotated).
+        center: (3,) point the cameras look at.
+        distance: Camera distance from `center`.
+        azimuth: (N,) candidate azimuth angles (in degrees).
+        elevation: (N,) candidate elevation angles (in degrees).
+        coverage_target: Fraction of the visible surface area to cover.
+        max_views: Upper bound on the number of selected views.
+        resolution: Visibility raster resolution, keep the render aspect ratio.
+
+    Returns:
+        selected: Indices into the candidates, in selection order.
+    """
+    raster = SoftwareRenderer(resolution=resolution)
+    raster.load(scene)
+    triangles = raster.vertices[raster.faces]
+    face_area = 0.5 * np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1)
+
+    transforms = camera_poses(center, distance, azimuth, elevation)
+    visible = np.zeros((len(transforms), len(raster.faces)), dtype=bool)
+    for index, camera_transform in enumerate(transforms):
+        visible[index] = raster.visible_faces(camera_transform)
+
+    # Area each candidate sees, restricted to faces some candidate sees
+    area = np.where(visible.any(axis=0), face_area, 0.0)
+    total = area.sum()
+    selected = []
+    covered = np.zeros(len(area), dtype=bool)
+    while len(selected) < max_views and area[covered].sum() < coverage_target * total:
+        gain = visible @ np.where(covered, 0.0, area)
+        best = int(np.argmax(gain))
+        if gain[best] <= 0:
+            break
+        selected.append(best)
+        covered |= visible[best]
+    return np.asarray(selected, dtype=np.int64)
+
+
+def project_points(points: np.ndarray, camera_transforms: np.ndarray, K: np.ndarray) -> tuple:
+    """
+    Project world points into every view at once (OpenGL camera, looking down -Z).
+
+    Returns:
+        uv: (V, N, 2) pixel coordinates.
+        depth: (V, N) distance along the view axis, <= 0 behind the camera.
+    """
+    world_to_camera = np.linalg.inv(camera_transforms)
+    points = np.asarray(points, dtype=np.float64)
+    camera = np.einsum('vij,nj->vni', world_to_camera[:, :3, :3], points) + world_to_camera[:, None, :3, 3]
+    depth = -camera[..., 2]
+    safe = np.where(depth > 0, depth, np.inf)
+    uv = np.stack([
+        K[0, 2] + K[0, 0] * camera[..., 0] / safe,
+        K[1, 2] - K[1, 1] * camera[..., 1] / safe,
+    ], axis=-1)
+    return uv, depth
+
+
+def backproject(depth: np.ndarray, transform: np.ndarray, K: np.ndarray, stride: int = 2) -> tuple:
+    """
+    Lift every `stride`-th pixel with depth to the world (OpenGL camera, pixel centres).
+
+    Returns:
+        points: (N, 3) world coordinates.
+        ys, xs: (N,) pixel rows and columns of the points.
+    """
+    ys, xs = np.nonzero(depth[::stride, ::stride] > 0)
+    ys, xs = ys * stride, xs * stride
+    d = depth[ys, xs].astype(np.float64)
+    camera = np.stack([
+        (xs + 0.5 - K[0, 2]) * d / K[0, 0],
+        -(ys + 0.5 - K[1, 2]) * d / K[1, 1],
+        -d,
+    ], axis=1)
+    return camera @ transform[:3, :3].T + transform[:3, 3], ys, xs
+
+
+def _barycentric(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """(N, 3) barycentric weights of `points` (N, 3) on `triangles` (N, 3, 3), clipped into the triangle."""
+    e1, e2 = triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    offset = points - triangles[:, 0]
+    d11, d12, d22 = (e1 * e1).sum(1), (e1 * e2).sum(1), (e2 * e2).sum(1)
+    o1, o2 = (offset * e1).sum(1), (offset * e2).sum(1)
+    denominator = d11 * d22 - d12 ** 2
+    safe = np.where(np.abs(denominator) > 1e-30, denominator, 1.0)
+    b1 = np.where(np.abs(denominator) > 1e-30, (d22 * o1 - d12 * o2) / safe, 1.0 / 3.0)
+    b2 = np.where(np.abs(denominator) > 1e-30, (d11 * o2 - d12 * o1) / safe, 1.0 / 3.0)
+    # Pixel centres on a face edge can fall marginally outside of it
+    weights = np.clip(np.stack([1.0 - b1 - b2, b1, b2], axis=1), 0, None)
+    return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+
+
+def _disk(radius: int) -> np.ndarray:
+    """(M, 2) integer pixel offsets within `radius`."""
+    offsets = np.stack(np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1)), -1).reshape(-1, 2)
+    return offsets[(offsets ** 2).sum(axis=1) <= radius ** 2]
+
+
+def draw_marks(
+        rgba: np.ndarray,
+        segments: np.ndarray,
+        segment_colors: np.ndarray,
+        points: np.ndarray,
+        point_colors: np.ndarray,
+        line_radius: int = 1,
+        point_radius: int = 3,
+    ) -> np.ndarray:
+    """
+    Draw 2D line segments and then dots into an RGBA image in place.
+
+    Parameters:
+        rgba: (H, W, 4) uint8 image.
+        segments: (S, 2, 2) pixel coordinates of the segment end points.
+        segment_colors: (S, 4) uint8 colours.
+        points: (P, 2) pixel coordinates of the dots.
+        point_colors: (P, 4) uint8 colours.
+    """
+    height, width = rgba.shape[:2]
+    if len(segments) > 0:
+        # Sample every segment at (at least) one step per pixel
+        length = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+        steps = int(np.ceil(np.nan_to_num(length, posinf=0).max(initial=0))) + 2
+        t = np.linspace(0.0, 1.0, min(steps, 4 * (width + height)))
+        samples = segments[:, None, 0] + t[None, :, None] * (segments[:, None, 1] - segments[:, None, 0])
+        colors = np.repeat(segment_colors, len(t), axis=0)
+        _splat(rgba, samples.reshape(-1, 2), colors, _disk(line_radius))
+    if len(points) > 0:
+        _splat(rgba, points, point_colors, _disk(point_radius))
+    return rgba
+
+
+def _splat(rgba: np.ndarray, centers: np.ndarray, colors: np.ndarray, offsets: np.ndarray) -> None:
+    """Write `colors` at every pixel offset around each of `centers`."""
+    height, width = rgba.shape[:2]
+    finite = np.isfinite(centers).all(axis=1)
+    centers, colors = np.floor(centers[finite]).astype(np.int64), colors[finite]
+    pixels = (centers[:, None, :] + offsets[None]).reshape(-1, 2)
+    colors = np.repeat(colors, len(offsets), axis=0)
+    inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)
+    rgba[pixels[inside, 1], pixels[inside, 0]] = colors[inside]
+
+
+def save_cameras(
+        path: str,
+        transforms: np.ndarray,
+        Ks: np.ndarray,
+        azimuth: np.ndarray,
+        elevation: np.ndarray,
+        resolution: tuple,
+    ) -> None:
+    """Write the camera rig of an asset; view i corresponds to `images/render_i.png`."""
+    np.savez(
+        path,
+        transforms=np.asarray(transforms, dtype=np.float64),
+        Ks=np.asarray(Ks, dtype=np.float64),
+        azimuth=np.asarray(azimuth, dtype=np.float64),
+        elevation=np.asarray(elevation, dtype=np.float64),
+        resolution=np.asarray(resolution, dtype=np.int64),
+    )
+
+
+def load_cameras(asset_path: str) -> dict:
+    """
+    Read the camera rig written by `render_views` for a rendered asset folder.
+
+    Returns:
+        Dict with `transforms` (N, 4, 4), `Ks` (N, 3, 3), `azimuth` (N,),
+        `elevation` (N,) and `resolution` (2,).
+    """
+    with np.load(os.path.join(asset_path, 'cameras.npz')) as cameras:
+        return {key: cameras[key] for key in cameras.files}
+
+
+def save_buffers(path: str, passes: dict, instance_names: list) -> None:
+    """Write the depth, normal and instance buffers of one view as a compressed `.npz`."""
+    np.savez_compressed(
+        path,
+        depth=passes['depth'],
+        normal=passes['normal'],
+        instance=passes['instance'],
+        instance_names=np.asarray(instance_names, dtype=str),
+    )
+
+
+def load_buffers(asset_path: str, view_name: str) -> dict:
+    """
+    Read the auxiliary buffers of `view_name` (e.g. 'render_0') from a rendered asset folder.
+
+    Returns:
+        Dict with `depth`, `normal`, `instance` and `instance_names`, see `Renderer.render_passes`.
+    """
+    with np.load(os.path.join(asset_path, 'buffers', view_name + '.npz')) as buffers:
+        return {key: buffers[key] for key in buffers.files}
+
+
+class RenderCache:
+    """
+    On-disk cache of rendered views keyed by the GLB content hash plus the
+    render parameters, so unchanged assets are never re-rendered.
+
+    Each entry `<cache_dir>/<key>/` mirrors the files `render_views` wrote
+    into the asset folder (`images/`, `cameras.npz`, optional `buffers/`).
+    Entries are written to a temporary folder and renamed, so concurrent
+    render workers never observe a partial entry.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(glb_path: str, params: dict) -> str:
+        """Hash the GLB bytes together with the render parameters."""
+        digest = hashlib.sha256()
+        with open(glb_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps(params, sort_keys=True, default=list).encode())
+        return digest.hexdigest()
+
+    def restore(self, key: str, asset_path: str) -> bool:
+        """
+        Copy the cached files of `key` into `asset_path`, returns False on a miss.
+        Cached folders replace the asset's folders, so no view of an earlier
+        render with another view set is left behind.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        if not os.path.exists(os.path.join(entry, 'cameras.npz')):
+            return False
+        os.makedirs(asset_path, exist_ok=True)
+        for name in os.listdir(entry):
+            source, target = os.path.join(entry, name), os.path.join(asset_path, name)
+            if os.path.isdir(source):
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.copytree(source, target)
+            else:
+                shutil.copyfile(source, target)
+        return True
+
+    def store(self, key: str, asset_path: str, files: list) -> None:
+        """Add `files` (paths relative to `asset_path`) under `key`."""
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry):
+            return
+        tmp_entry = f"{entry}.tmp-{os.getpid()}"
+        for name in files:
+            os.makedirs(os.path.dirname(os.path.join(tmp_entry, name)), exist_ok=True)
+            shutil.copyfile(os.path.join(asset_path, name), os.path.join(tmp_entry, name))
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
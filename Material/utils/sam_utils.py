@@ -3,13 +3,23 @@ Code token from : https://github.com/xxlbigbrother/Gaussian-Property.git
 """
 import os
 import cv2
+import shutil
 import torch
+import time
+import queue
+import hashlib
+import threading
 import random
 import numpy as np
 from tqdm import tqdm
 from PIL import Image
+from scipy import ndimage
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib.colors import ListedColormap
 import matplotlib.pyplot as plt
+from utils.render_utils import load_buffers
+from utils.fusion_utils import load_selected_parts
+from utils.label_utils import LabelStore, save_labels
 
 def resize_image(image, max_size=1280):
     # Get the current size of the image
@@ -42,30 +52,362 @@ def seed_everything(seed_value):
         torch.backends.cudnn.deterministic = True
         torch.backends.cudnn.benchmark = True
 
-def create(image_list, alpha_list, data_list, save_folder, mask_generator):
-    """Generates segmentation maps for each image in the list."""
+
+def cpu_sockets() -> list:
+    """CPUs usable by this process grouped by socket (physical package), one group if the topology is unknown."""
+    usable = sorted(os.sched_getaffinity(0))
+    sockets = {}
+    for cpu in usable:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id") as f:
+                socket = int(f.read())
+        except (OSError, ValueError):
+            socket = 0
+        sockets.setdefault(socket, []).append(cpu)
+    return [sockets[socket] for socket in sorted(sockets)]
+
+
+def configure_cpu(cpus: list = None, num_threads: int = None) -> None:
+    """Pin this process to `cpus` and set the intra-op thread count (one per pinned CPU if None)."""
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    if num_threads is None and cpus is not None:
+        num_threads = len(cpus)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+
+def _to_float32(value):
+    """Cast the floating point tensors of (nested) encoder outputs back to float32."""
+    if torch.is_tensor(value):
+        return value.float() if value.is_floating_point() else value
+    if isinstance(value, dict):
+        return {k: _to_float32(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_float32(v) for v in value)
+    return value
+
+
+def optimize_for_cpu(sam2: torch.nn.Module, precision: str = 'fp32') -> torch.nn.Module:
+    """
+    Reduce the precision of the SAM2 image encoder for CPU inference.
+
+    'bf16' stores the encoder weights in bfloat16 and feeds it bfloat16
+    images, 'int8' replaces its linear layers with dynamically quantized
+    int8 ones. Either way the encoder returns float32 features, so the
+    prompt encoder and mask decoder run in full precision. 'fp32' keeps the
+    model as is.
+    """
+    encoder = sam2.image_encoder
+    if precision == 'fp32':
+        return sam2
+    if precision == 'bf16':
+        encoder.to(torch.bfloat16)
+        cast = torch.bfloat16
+    elif precision == 'int8':
+        encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        cast = None
+    else:
+        raise ValueError(f"Unknown CPU precision: {precision}")
+
+    forward = encoder.forward
+
+    def reduced_forward(sample, *args, **kwargs):
+        if cast is not None:
+            sample = sample.to(cast)
+        return _to_float32(forward(sample, *args, **kwargs))
+
+    encoder.forward = reduced_forward
+    sam2.image_encoder = encoder
+    return sam2
+
+class EmbeddingCache:
+    """
+    On-disk cache of SAM2 image embeddings keyed by the content hash of the
+    encoded image (crop) plus the checkpoint and model config, so that
+    re-segmenting unchanged renders with other thresholds skips the encoder.
+
+    Each entry `<cache_dir>/<key>.pt` holds the `image_embed` and
+    `high_res_feats` tensors of one image, stored as fp16 and loaded back
+    as fp32. Entries are saved through a writer (an `AsyncWriter`) if one
+    is given, off the encoder loop. A hit refreshes the entry's
+    modification time and `evict` deletes the least recently used entries
+    until the cache holds at most `max_bytes`. Entries are written to a
+    temporary file and renamed, so concurrent workers never read a partial one.
+    """
+    def __init__(self, cache_dir: str, sam2_checkpoint: str, model_cfg: str, max_bytes: int = 20 * 2 ** 30, precision: str = 'fp32'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # Embeddings depend on the weights, the architecture and the encoder precision (see `optimize_for_cpu`)
+        digest = hashlib.sha256(f"{os.path.basename(model_cfg)}-{precision}".encode())
+        with open(sam2_checkpoint, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.model_hash = digest.hexdigest()
+
+    def key(self, image: np.ndarray) -> str:
+        """Hash the image pixels (and shape) together with the model."""
+        digest = hashlib.sha256(self.model_hash.encode())
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).tobytes())
+        return digest.hexdigest()
+
+    def load(self, key: str, device):
+        """Cached features of `key` on `device`, None on a miss."""
+        path = os.path.join(self.cache_dir, key + '.pt')
+        try:
+            features = torch.load(path, map_location=device)
+        except (FileNotFoundError, EOFError, RuntimeError):
+            return None
+        os.utime(path)
+        return {
+            "image_embed": features["image_embed"].float(),
+            "high_res_feats": [feat.float() for feat in features["high_res_feats"]],
+        }
+
+    def store(self, key: str, features: dict, writer=None) -> None:
+        """Add the features of one image (copied to the CPU as fp16) under `key`, through `writer` if set."""
+        path = os.path.join(self.cache_dir, key + '.pt')
+        write(writer, self._save, path, {
+            "image_embed": features["image_embed"].detach().to('cpu', torch.float16),
+            "high_res_feats": [feat.detach().to('cpu', torch.float16) for feat in features["high_res_feats"]],
+        })
+
+    @staticmethod
+    def _save(path: str, features: dict) -> None:
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        torch.save(features, tmp_path)
+        os.replace(tmp_path, path)
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in `max_bytes`."""
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.pt')]
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class AsyncWriter:
+    """
+    Background thread writing the segmentation outputs (PNG and `.npy`
+    files, cached embeddings) through a bounded queue, so that encoding and file system latency
+    overlap with the segmentation of the next view.
+
+    `submit` blocks while `max_pending` writes are queued, which bounds the
+    memory held by pending images. `flush` waits until every submitted write
+    is on disk and re-raises the first failed write. The queue high-water
+    mark and the time callers spent blocked are kept for `report`.
+    """
+    def __init__(self, max_pending: int = 64):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.high_water = 0
+        self.blocked = 0.0
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                fn, args = task
+                if self.error is None:
+                    fn(*args)
+                    self.written += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args) -> None:
+        """Queue `fn(*args)`; the arguments must not be modified afterwards."""
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait((fn, args))
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put((fn, args))
+            self.blocked += time.perf_counter() - start
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def flush(self) -> None:
+        """Barrier: wait for every submitted write."""
+        start = time.perf_counter()
+        self.queue.join()
+        self.blocked += time.perf_counter() - start
+        if self.error is not None:
+            raise self.error
+
+    def close(self) -> None:
+        """Flush and stop the writer thread."""
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+    def report(self) -> None:
+        print(f"Writer: {self.written} files, queue high-water mark {self.high_water}/{self.queue.maxsize}, "
+              f"{self.blocked:.2f}s blocked")
+
+
+def write(writer, fn, *args):
+    """Run the write `fn(*args)` on `writer` (an `AsyncWriter`), or right away if it is None."""
+    if writer is None:
+        fn(*args)
+    else:
+        writer.submit(fn, *args)
+
+
+def foreground_box(alpha, margin):
+    """
+    (rows, cols) slices of the bounding box of the foreground (`alpha > 0`,
+    the complement of the background of `sam_encoder`) grown by `margin`
+    pixels, None without any.
+    """
+    rows, cols = np.nonzero(np.any(alpha > 0, axis=1))[0], np.nonzero(np.any(alpha > 0, axis=0))[0]
+    if len(rows) == 0:
+        return None
+    # At least one pixel of margin, so that the crop's corner (the background label in `sam_encoder`) stays outside the object
+    margin = max(int(margin), 1)
+    return (
+        slice(max(rows[0] - margin, 0), min(rows[-1] + 1 + margin, alpha.shape[0])),
+        slice(max(cols[0] - margin, 0), min(cols[-1] + 1 + margin, alpha.shape[1])),
+    )
+
+
+def create(image_list, alpha_list, data_list, save_folder, mask_generator, batch_size=1, writer=None, crop_margin=None, min_foreground_area=0):
+    """
+    Generates segmentation maps for each image in the list.
+
+    With a generator that has `encode_batch`, the image encoder runs over the
+    crops of all views first, `batch_size` crops at a time (through its
+    embedding cache if any), and every view then only decodes its point prompts.
+    The outputs are written through `writer` (an `AsyncWriter`) if set, the
+    label maps of all views packed into `<save_folder>/labels.npz`.
+
+    With `crop_margin` every view is segmented within its foreground bounding
+    box grown by `crop_margin` pixels (so the point grid covers the object
+    rather than the frame) and the labels are pasted back into the full
+    frame. Views with fewer than `min_foreground_area` foreground pixels
+    (`alpha > 0`, as in `sam_encoder`) are not segmented and get an empty
+    label map.
+    """
     assert image_list is not None, "image_list must be provided to generate features"
-    mask_generator.predictor.model.to('cuda')
+    boxes = []
+    for alpha in alpha_list:
+        if np.count_nonzero(alpha > 0) < min_foreground_area:
+            boxes.append(None)
+        elif crop_margin is None:
+            boxes.append((slice(None), slice(None)))
+        else:
+            boxes.append(foreground_box(alpha, crop_margin))
+    if hasattr(mask_generator, 'encode_batch'):
+        mask_generator.encode_batch(
+            [
+                np.ascontiguousarray(cv2.cvtColor(img.permute(1, 2, 0).numpy().astype(np.uint8), cv2.COLOR_BGR2RGB)[box])
+                for img, box in zip(image_list, boxes) if box is not None
+            ],
+            batch_size=batch_size,
+        )
+    seg_maps = {}
     for i, img in tqdm(enumerate(image_list), desc="Processing images", unit=" image", leave=False):
         alpha = alpha_list[i]
         save_path = os.path.join(save_folder, data_list[i].split('.')[0])
-        seg_map_vis = sam_encoder(img.unsqueeze(0), alpha, save_path, mask_generator)
-    
+        if boxes[i] is None:
+            image = cv2.cvtColor(img.permute(1, 2, 0).numpy().astype(np.uint8), cv2.COLOR_BGR2RGB)
+            seg_map_vis = save_segmentation(image, -np.ones(image.shape[:2], dtype=np.int32), save_path, writer, seg_maps)
+        else:
+            seg_map_vis = sam_encoder(img.unsqueeze(0), alpha, save_path, mask_generator, writer, seg_maps, boxes[i])
+
+    write(writer, save_labels, save_folder, seg_maps)
     return seg_map_vis
 
 
-def save_numpy(save_path, seg_map):
-    """Saves segmentation maps as numpy files."""
+def load_view(image_path):
+    """Decodes a rendered view once into its BGR image tensor (3, H, W) and binary alpha mask (H, W)."""
+    image_bgra = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image_bgra.ndim == 3 and image_bgra.shape[2] == 4:
+        alpha = image_bgra[:, :, 3]
+    else:
+        alpha = np.full(image_bgra.shape[:2], 255, dtype=np.uint8)
+    image_bgr = image_bgra[:, :, :3] if image_bgra.ndim == 3 else cv2.cvtColor(image_bgra, cv2.COLOR_GRAY2BGR)
+
+    # Ensure alpha mask is binary
+    alpha = np.where(alpha >= 125, 255, 0).astype(np.uint8)
+    return torch.from_numpy(np.ascontiguousarray(image_bgr)).permute(2, 0, 1), alpha
+
+
+def load_asset_views(asset_path):
+    """Returns the sorted view names, image tensors and alpha masks of an asset's `images/` folder."""
+    img_folder = os.path.join(asset_path, 'images')
+    data_list = sorted(os.listdir(img_folder))
+    views = [load_view(os.path.join(img_folder, data_path)) for data_path in data_list]
+    return data_list, [image for image, _ in views], [alpha for _, alpha in views]
+
+
+def prefetch_assets(render_images_path, assets):
+    """
+    Yields (asset, data_list, images, alphas) for every asset folder in `assets`.
+
+    The views of the next asset are decoded on a background thread while the
+    caller processes the current one, so only two assets are in memory at once.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        if len(assets) > 0:
+            pending = executor.submit(load_asset_views, os.path.join(render_images_path, assets[0]))
+        for i, asset in enumerate(assets):
+            data_list, images, alphas = pending.result()
+            if i + 1 < len(assets):
+                pending = executor.submit(load_asset_views, os.path.join(render_images_path, assets[i + 1]))
+            yield asset, data_list, images, alphas
+
+
+def submesh_count(asset_path, data_list):
+    """Returns the number of submeshes in the rendered instance buffers, 0 if they were not rendered."""
+    view_name = data_list[0].split('.')[0]
+    if not os.path.exists(os.path.join(asset_path, 'buffers', view_name + '.npz')):
+        return 0
+    return len(load_buffers(asset_path, view_name)['instance_names'])
+
+
+def create_from_instances(image_list, data_list, save_folder, asset_path, writer=None):
+    """Generates segmentation maps for each image from the rendered per-submesh instance buffers."""
+    assert image_list is not None, "image_list must be provided to generate features"
+    seg_maps = {}
+    for i, img in tqdm(enumerate(image_list), desc="Processing images", unit=" image", leave=False):
+        view_name = data_list[i].split('.')[0]
+        save_path = os.path.join(save_folder, view_name)
+        instance = load_buffers(asset_path, view_name)['instance']
+        seg_map_vis = instance_encoder(img.unsqueeze(0), instance, save_path, writer=writer, seg_maps=seg_maps)
+
+    write(writer, save_labels, save_folder, seg_maps)
+    return seg_map_vis
+
+
+def save_numpy(save_path, seg_map, writer=None):
+    """Saves segmentation maps as numpy files (legacy per-view format, see `save_labels`)."""
     save_path_s = save_path + '_s.npy'
-    np.save(save_path_s, seg_map)
+    write(writer, np.save, save_path_s, seg_map)
 
 
 def get_seg_img(image, mask, bbox):
-    """Extracts a segmented image using the mask and bounding box."""
-    image = image.copy()
-    image[mask == 0] = np.array([0, 0, 0], dtype=np.uint8)
+    """Extracts a segmented image using the mask and bounding box (only the box is copied)."""
     x, y, w, h = np.int32(bbox)
-    return image[y:y+h, x:x+w, ...]
+    return np.where(mask[y:y+h, x:x+w, None], image[y:y+h, x:x+w], 0).astype(np.uint8)
 
 
 def pad_img(img):
@@ -81,9 +423,25 @@ def pad_img(img):
 
 
 def filter(keep: torch.Tensor, masks_result) -> list:
-    """Filters masks based on the indices in `keep`."""
-    keep = keep.int().cpu().numpy()
-    return [m for i, m in enumerate(masks_result) if i in keep]
+    """Filters masks based on the indices in `keep` (original order is kept)."""
+    keep = np.unique(keep.int().cpu().numpy())
+    return [masks_result[i] for i in keep.tolist()]
+
+
+def pairwise_intersection(masks, chunk_pixels=2 ** 16):
+    """
+    (N, N) pixel counts of the pairwise intersections of N binary masks.
+
+    One matmul of the flattened masks per chunk of `chunk_pixels` pixels, so
+    the float copy stays small; 0/1 products summed in float32 are exact up
+    to 2^24 pixels.
+    """
+    flat = masks.reshape(masks.shape[0], -1).bool()
+    intersection = torch.zeros((flat.shape[0],) * 2, dtype=torch.float, device=masks.device)
+    for start in range(0, flat.shape[1], chunk_pixels):
+        chunk = flat[:, start:start + chunk_pixels].float()
+        intersection += chunk @ chunk.T
+    return intersection
 
 
 def mask_nms(masks, scores, iou_thr=0.7, score_thr=0.1, inner_thr=0.2):
@@ -94,20 +452,19 @@ def mask_nms(masks, scores, iou_thr=0.7, score_thr=0.1, inner_thr=0.2):
     masks_ord = masks[idx.view(-1), :]
     masks_area = torch.sum(masks_ord, dim=(1, 2), dtype=torch.float)
 
-    iou_matrix = torch.zeros((num_masks,) * 2, dtype=torch.float, device=masks.device)
-    inner_iou_matrix = torch.zeros((num_masks,) * 2, dtype=torch.float, device=masks.device)
-    for i in range(num_masks):
-        for j in range(i, num_masks):
-            intersection = torch.sum(torch.logical_and(masks_ord[i], masks_ord[j]), dtype=torch.float)
-            union = torch.sum(torch.logical_or(masks_ord[i], masks_ord[j]), dtype=torch.float)
-            iou = intersection / union
-            iou_matrix[i, j] = iou
-            if intersection / masks_area[i] < 0.5 and intersection / masks_area[j] >= 0.85:
-                inner_iou = 1 - (intersection / masks_area[j]) * (intersection / masks_area[i])
-                inner_iou_matrix[i, j] = inner_iou
-            if intersection / masks_area[i] >= 0.85 and intersection / masks_area[j] < 0.5:
-                inner_iou = 1 - (intersection / masks_area[j]) * (intersection / masks_area[i])
-                inner_iou_matrix[j, i] = inner_iou
+    # All pairs at once: intersection from one matmul, union from the areas
+    intersection = pairwise_intersection(masks_ord)
+    union = masks_area[:, None] + masks_area[None, :] - intersection
+    iou_matrix = intersection / union
+    # Fraction of mask i (rows) and of mask j (columns) covered by the intersection
+    ratio_i = intersection / masks_area[:, None]
+    ratio_j = intersection / masks_area[None, :]
+    inner_iou = 1 - ratio_j * ratio_i
+    # For i <= j: j mostly inside i goes to [i, j], i mostly inside j to [j, i]
+    upper = torch.ones((num_masks,) * 2, dtype=torch.bool, device=masks.device).triu_()
+    inner_ij = upper & (ratio_i < 0.5) & (ratio_j >= 0.85)
+    inner_ji = upper & (ratio_i >= 0.85) & (ratio_j < 0.5)
+    inner_iou_matrix = torch.where(inner_ij, inner_iou, 0) + torch.where(inner_ji, inner_iou, 0).T
 
     iou_matrix.triu_(diagonal=1)
     iou_max, _ = iou_matrix.max(dim=0)
@@ -154,6 +511,12 @@ def masks_update(*args, **kwargs):
     return masks_new
 
 
+def label_boxes(seg_map):
+    """Bounding slices (rows, cols) of every label >= 0 of the segmentation map, all found in one pass."""
+    objects = ndimage.find_objects(seg_map + 1)
+    return {label: box for label, box in enumerate(objects) if box is not None}
+
+
 def get_location(image, foreground_mask):
     """Finds the bounding box for the largest contour in the mask."""
     contours, _ = cv2.findContours(foreground_mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -162,25 +525,28 @@ def get_location(image, foreground_mask):
     return [x, y, w, h]
 
 
-def vis_segmap_sam(seg_map, debug_vis_path):
+def vis_segmap_sam(seg_map, debug_vis_path, writer=None):
     """Visualizes the segmentation map."""
-    vis_mask = np.zeros((seg_map.shape[0], seg_map.shape[1], 3), dtype=np.uint8)
-    unique_values = np.unique(seg_map)
-    colors = {value: [255, 255, 255] if value == -1 else list(np.random.choice(range(256), size=3)) for value in unique_values}
-    for key, color in colors.items():
-        vis_mask[seg_map == key] = color
+    unique_values, index = np.unique(seg_map, return_inverse=True)
+    # One palette entry per label, the map is coloured with a single lookup
+    palette = np.array([[255, 255, 255] if value == -1 else np.random.choice(range(256), size=3) for value in unique_values], dtype=np.uint8)
+    vis_mask = palette[index.reshape(seg_map.shape)]
 
-    cv2.imwrite(f'{os.path.join(debug_vis_path, "seg_map.png")}', vis_mask[:, :, [2, 1, 0]])
+    write(writer, cv2.imwrite, f'{os.path.join(debug_vis_path, "seg_map.png")}', vis_mask[:, :, [2, 1, 0]])
     return vis_mask[:, :, [2, 1, 0]]
 
 
-def sam_encoder(image, alpha, save_path, mask_generator):
-    """Encodes the image and generates segmentation maps."""
-    vis_seg_path = save_path.replace("seg", "vis_seg")
-    os.makedirs(vis_seg_path, exist_ok=True)
-    os.makedirs(os.path.join(vis_seg_path, "part"), exist_ok=True)
+def sam_encoder(image, alpha, save_path, mask_generator, writer=None, seg_maps=None, box=None):
+    """
+    Encodes the image and generates segmentation maps.
 
+    With `box` ((rows, cols) slices) only that region is segmented and its
+    labels are pasted back into the full frame.
+    """
     image = cv2.cvtColor(image[0].permute(1, 2, 0).numpy().astype(np.uint8), cv2.COLOR_BGR2RGB)
+    full_image = image
+    if box is not None:
+        image, alpha = np.ascontiguousarray(image[box]), alpha[box]
     curr_anns = mask_generator.generate(image)
     masks_m = curr_anns
     masks_m = masks_update(masks_m, iou_thr=0.8, score_thr=0.7, inner_thr=0.5)[0]
@@ -199,18 +565,51 @@ def sam_encoder(image, alpha, save_path, mask_generator):
     seg_map[seg_map == background] = -1
 
     seg_map[alpha == 0] = -1
-    seg_map_vis = vis_segmap_sam(seg_map, vis_seg_path)
+    if box is not None:
+        full_seg_map = -np.ones(full_image.shape[:2], dtype=np.int32)
+        full_seg_map[box] = seg_map
+        seg_map = full_seg_map
+    return save_segmentation(full_image, seg_map, save_path, writer, seg_maps)
 
-    for i in np.unique(seg_map):
-        if i == -1:
-            continue
-        cur_mask = seg_map == i
-        bbox = get_location(image, cur_mask)
-        seg_img = get_seg_img(image, cur_mask, bbox)
+
+def instance_encoder(image, instance, save_path, min_area=300, writer=None, seg_maps=None):
+    """Builds the segmentation map of a view directly from its per-submesh instance buffer."""
+    image = cv2.cvtColor(image[0].permute(1, 2, 0).numpy().astype(np.uint8), cv2.COLOR_BGR2RGB)
+
+    # Label k + 1 is submesh k in every view, 0 is foreground too small to be a part
+    seg_map = np.where(instance >= 0, instance + 1, -1).astype(np.int32)
+    labels, areas = np.unique(seg_map[seg_map > 0], return_counts=True)
+    seg_map[np.isin(seg_map, labels[areas < min_area])] = 0
+
+    return save_segmentation(image, seg_map, save_path, writer, seg_maps)
+
+
+def save_segmentation(image, seg_map, save_path, writer=None, seg_maps=None):
+    """
+    Saves the visualisation, per-part crops and label map of one view (through `writer` if set).
+
+    With `seg_maps` the label map is added to it under the view name, to be
+    packed with the other views by `save_labels`, instead of its own `.npy`.
+    """
+    vis_seg_path = save_path.replace("seg", "vis_seg")
+    os.makedirs(vis_seg_path, exist_ok=True)
+    os.makedirs(os.path.join(vis_seg_path, "part"), exist_ok=True)
+
+    seg_map_vis = vis_segmap_sam(seg_map, vis_seg_path, writer)
+
+    # Every part is cropped from its bounding box, never from the full image
+    for i, box in label_boxes(seg_map).items():
+        part_image = image[box]
+        cur_mask = seg_map[box] == i
+        bbox = get_location(part_image, cur_mask)
+        seg_img = get_seg_img(part_image, cur_mask, bbox)
         pad_seg_img = cv2.resize(pad_img(seg_img), (224, 224))
-        cv2.imwrite(f"{vis_seg_path}/part/mask_{i}.png", pad_seg_img[:, :, [2, 1, 0]])
+        write(writer, cv2.imwrite, f"{vis_seg_path}/part/mask_{i}.png", pad_seg_img[:, :, [2, 1, 0]])
 
-    save_numpy(save_path, seg_map)
+    if seg_maps is None:
+        save_numpy(save_path, seg_map, writer)
+    else:
+        seg_maps[os.path.basename(save_path)] = seg_map
     return Image.fromarray(seg_map_vis)
 
 
@@ -221,10 +620,13 @@ def save_gpt_input(base_path):
 
         image_base = f"{case_name}/images"
         number_view = len(os.listdir(image_base))
-        feature_base = f"{case_name}/seg"
         vis_seg_base = f"{case_name}/vis_seg"
 
         base_gpt_test_path = os.path.join(case_name, "gpt_input")
+        # Inputs of an earlier run (other views, or all views before fusing) must not reach the VLM
+        selected = load_selected_parts(case_name)
+        if os.path.exists(base_gpt_test_path):
+            shutil.rmtree(base_gpt_test_path)
         os.makedirs(base_gpt_test_path, exist_ok=True)
 
         image_list = sorted(os.listdir(image_base))
@@ -232,66 +634,68 @@ def save_gpt_input(base_path):
         asset_front_view = cv2.imread(os.path.join(image_base, image_list[0]))
         asset_front_view = cv2.cvtColor(asset_front_view, cv2.COLOR_BGR2RGB)
 
-        for i, _ in tqdm(enumerate(range(number_view)), desc="Processing views", unit=" view", leave=False):
+        with LabelStore(f"{case_name}/seg") as label_store:
+            for i, _ in tqdm(enumerate(range(number_view)), desc="Processing views", unit=" view", leave=False):
             
-            image_name = image_list[i].split('.')[0]
+                image_name = image_list[i].split('.')[0]
 
-            cur_gpt_path = os.path.join(base_gpt_test_path, image_name)
-            os.makedirs(cur_gpt_path, exist_ok=True)
+                cur_gpt_path = os.path.join(base_gpt_test_path, image_name)
+                os.makedirs(cur_gpt_path, exist_ok=True)
 
-            img_path = os.path.join(image_base, image_name + '.png')
-            s_path = os.path.join(feature_base, image_name + '_s.npy')
-            seg_path = os.path.join(vis_seg_base, image_name + '/part')
-            ss = np.load(s_path)
-            rgba_image = cv2.imread(img_path)
-            image = cv2.cvtColor(rgba_image, cv2.COLOR_BGR2RGB)
+                img_path = os.path.join(image_base, image_name + '.png')
+                seg_path = os.path.join(vis_seg_base, image_name + '/part')
+                ss = label_store[image_name]
+                rgba_image = cv2.imread(img_path)
+                image = cv2.cvtColor(rgba_image, cv2.COLOR_BGR2RGB)
 
-            mask = ss
+                mask = ss
 
-            # Find different labels in the mask
-            labels = np.unique(mask)
-            labels = labels[labels != -1]  # Remove non-material parts from the mask
+                # Find different labels in the mask
+                labels = np.unique(mask)
+                labels = labels[labels != -1]  # Remove non-material parts from the mask
 
-            # Generate random colors for each label
-            colors = {}
-            for label in labels:
-                colors[label] = (random.random(), random.random(), random.random())
+                # Generate random colors for each label
+                colors = {}
+                for label in labels:
+                    colors[label] = (random.random(), random.random(), random.random())
 
-            # Create color mapping
-            cmap = ListedColormap([colors[label] for label in labels])
+                # Create color mapping
+                cmap = ListedColormap([colors[label] for label in labels])
 
-            for label in labels:
-                part_image = cv2.imread(os.path.join(seg_path, f"mask_{label}.png"))
-                part_image = cv2.cvtColor(part_image, cv2.COLOR_BGR2RGB)
+                for label in labels:
+                    if selected is not None and (image_name, int(label)) not in selected:
+                        continue
+                    part_image = cv2.imread(os.path.join(seg_path, f"mask_{label}.png"))
+                    part_image = cv2.cvtColor(part_image, cv2.COLOR_BGR2RGB)
 
-                # Create plot
-                fig, (ax1, ax2, ax3, ax4) = plt.subplots(1, 4, figsize=(32, 8))  # 1 row, 3 columns
+                    # Create plot
+                    fig, (ax1, ax2, ax3, ax4) = plt.subplots(1, 4, figsize=(32, 8))  # 1 row, 3 columns
 
-                # Display asset's front view on the first
-                ax1.imshow(asset_front_view)
-                ax1.set_title('Asset Front View')
-                ax1.axis('off')
+                    # Display asset's front view on the first
+                    ax1.imshow(asset_front_view)
+                    ax1.set_title('Asset Front View')
+                    ax1.axis('off')
 
-                # Display original image on the second
-                ax2.imshow(image)
-                ax2.set_title('Original Image')
-                ax2.axis('off')  # Turn off axis
+                    # Display original image on the second
+                    ax2.imshow(image)
+                    ax2.set_title('Original Image')
+                    ax2.axis('off')  # Turn off axis
 
-                # Display mask overlay on the third
-                ax3.imshow(image)
-                masked_image = np.ma.masked_where(mask != label, mask)
-                ax3.imshow(masked_image, cmap=cmap, alpha=0.4, vmin=np.min(mask), vmax=np.max(mask))
-                ax3.set_title('Mask Overlay')
-                ax3.axis('off')
+                    # Display mask overlay on the third
+                    ax3.imshow(image)
+                    masked_image = np.ma.masked_where(mask != label, mask)
+                    ax3.imshow(masked_image, cmap=cmap, alpha=0.4, vmin=np.min(mask), vmax=np.max(mask))
+                    ax3.set_title('Mask Overlay')
+                    ax3.axis('off')
 
-                # Display part image on the last
-                ax4.imshow(part_image)
-                ax4.set_title('Part Image')
-                ax4.axis('off')
+                    # Display part image on the last
+                    ax4.imshow(part_image)
+                    ax4.set_title('Part Image')
+                    ax4.axis('off')
 
-                plt.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05, wspace=0.1, hspace=0.1)
+                    plt.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05, wspace=0.1, hspace=0.1)
 
-                # Save the image to file
-                plt.savefig(f'{cur_gpt_path}/{str(label).zfill(2)}.png')
+                    # Save the image to file
+                    plt.savefig(f'{cur_gpt_path}/{str(label).zfill(2)}.png')
 
-                plt.close()
+                    plt.close()
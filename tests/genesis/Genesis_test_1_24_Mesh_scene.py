@@ -1,7 +1,18 @@
+import os
+import sys
 import genesis as gs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Material'))
+from utils.asset_processor import lod_file
 gs.init(backend=gs.cuda)
 
 
+def asset_file(file):
+    # Same lookup as gs.morphs.Mesh: from the CWD, then from the Genesis assets folder
+    if os.path.exists(os.path.abspath(file)):
+        return os.path.abspath(file)
+    return os.path.join(gs.utils.get_assets_dir(), file)
+
+
 scene = gs.Scene(
     show_viewer = False,
     sim_options=gs.options.SimOptions(
@@ -18,8 +29,9 @@ plane = scene.add_entity(
     gs.morphs.Plane(),
 )
 
+# A Mesh morph is drawn and collided with as one mesh: the textured render LOD serves both
 asset1 = scene.add_entity(
-    gs.morphs.Mesh(file='room.glb', 
+    gs.morphs.Mesh(file=lod_file(asset_file('room.glb'), 'render'), 
             pos=(0.0, 0.0, 2),
             euler=(90, 0, 180),
             scale=5,
@@ -33,7 +45,7 @@ asset1 = scene.add_entity(
 )
 
 asset2 = scene.add_entity(
-    gs.morphs.Mesh(file='Tree.glb', 
+    gs.morphs.Mesh(file=lod_file(asset_file('Tree.glb'), 'render'), 
             pos=(0.0, 0.0, 5),
             euler=(90, 0, 180),
             scale=0.5,
@@ -1,6 +1,18 @@
+import os
+import sys
 import genesis as gs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Material'))
+from utils.asset_processor import lod_file
 gs.init(backend=gs.cuda)
 
+
+def asset_file(file):
+    # Same lookup as gs.morphs.Mesh: from the CWD, then from the Genesis assets folder
+    if os.path.exists(os.path.abspath(file)):
+        return os.path.abspath(file)
+    return os.path.join(gs.utils.get_assets_dir(), file)
+
+
 dt = 2e-2
 scene = gs.Scene(
     show_viewer = False,
@@ -26,7 +38,7 @@ plane = scene.add_entity(
 )
 
 asset1 = scene.add_entity(
-    gs.morphs.Mesh(file='assets/merge_meshes/soda_can_merge.obj', 
+    gs.morphs.Mesh(file=lod_file(asset_file('assets/merge_meshes/soda_can_merge.obj'), 'mpm'), 
         pos=(-0.075, 0.075, 0.15),
         euler=(90, 0, 180),
         scale=0.15,